@@ -0,0 +1,93 @@
+import numpy as np
+from dataclasses import dataclass
+from rb_fit import rb_infidelity
+from program_cache import rb_ondevice
+from tracing import phase
+
+SEQUENCES_STEP = 100  # random sequences added at every increment
+MAX_SEQUENCES = 1000  # same budget as the fixed-size objective
+TARGET_ERROR = 1e-4  # stop once r_g_std is below this
+REJECT_SIGMAS = 3  # stop once the candidate is this many r_g_std above the incumbent
+MAX_FAILED_FITS = 2  # stop once this many increments could not resolve a decay
+
+
+@dataclass
+class SequentialEstimate:
+    """Inverse-variance pooled infidelity of successive RB increments."""
+
+    weighted_sum: float = 0.0
+    weight: float = 0.0
+    sequences: int = 0
+    failed_fits: int = 0
+    last: float = np.nan
+
+    def add(self, r_g, r_g_std, sequences):
+        self.sequences += sequences
+        self.last = r_g
+        # failed fits come back with a non-finite, vanishing or >100% error
+        if np.isfinite(r_g_std) and 0 < r_g_std < abs(r_g):
+            self.weighted_sum += r_g / r_g_std**2
+            self.weight += 1 / r_g_std**2
+        else:
+            self.failed_fits += 1
+
+    @property
+    def infidelity(self):
+        if self.weight == 0:
+            return self.last
+        return self.weighted_sum / self.weight
+
+    @property
+    def error(self):
+        if self.weight == 0:
+            return np.inf
+        return 1 / np.sqrt(self.weight)
+
+    def done(
+        self,
+        incumbent=None,
+        target_error=TARGET_ERROR,
+        max_sequences=MAX_SEQUENCES,
+    ):
+        if self.sequences >= max_sequences or self.error < target_error:
+            return True
+        # no visible decay, more sequences will not make the fit converge
+        if self.failed_fits >= MAX_FAILED_FITS:
+            return True
+        # clearly worse than the best point measured so far
+        lower_bound = self.infidelity - REJECT_SIGMAS * self.error
+        return incumbent is not None and lower_bound > incumbent
+
+
+def sequential_rb(
+    e,
+    target,
+    max_depth,
+    delta,
+    incumbent=None,
+    target_error=TARGET_ERROR,
+    step=SEQUENCES_STEP,
+    max_sequences=MAX_SEQUENCES,
+    callback=None,
+):
+    # the platform must already hold the candidate parameters, callback is
+    # called with the running estimate after every increment
+    estimate = SequentialEstimate()
+    while not estimate.done(incumbent, target_error, max_sequences):
+        sequences = min(step, max_sequences - estimate.sequences)
+        with phase("rb_ondevice"):
+            rb_output = rb_ondevice(
+                e,
+                num_of_sequences=sequences,
+                max_circuit_depth=max_depth,
+                delta_clifford=delta,
+                n_avg=1,
+                save_sequences=True,
+                apply_inverse=True,
+            )
+        estimate.add(*rb_infidelity(rb_output, target), sequences)
+        if callback is not None:
+            callback(estimate)
+
+    print(f"sequential RB stopped after {estimate.sequences} sequences")
+    return estimate.infidelity, estimate.error
@@ -0,0 +1,142 @@
+import numpy as np
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from session import open_executor
+from history import HistoryWriter
+from cma_main import save_results, update_platform
+from tracing import TRACER
+from warm_start import initial_state, INITIALIZERS
+from reporting import render_report, REPORT_MODES
+from sequence_pool import open_pool, POOL_MODES
+
+NSHOTS = 2000
+
+
+def parse(argv=None) -> Namespace:
+    parser = ArgumentParser(
+        description="Fine tuning calibration using Gaussian process Bayesian optimization"
+    )
+    parser.add_argument(
+        "--platform", type=str, required=True, help="Platform identifier"
+    )
+    parser.add_argument(
+        "--target", type=str, required=True, help="Target qubit to be calibrated"
+    )
+    parser.add_argument(
+        "--platform_update", action="store_true", help="Enable platform update"
+    )
+    parser.add_argument(
+        "--max_evaluations",
+        type=int,
+        help="RB evaluations, including the initial design "
+        "(default: bayesopt_utils.MAX_EVALUATIONS)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Points proposed per acquisition round "
+        "(default: bayesopt_utils.BATCH_SIZE)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Run RB in increments until the error bar is small enough",
+    )
+    parser.add_argument(
+        "--sequence_pool",
+        type=str,
+        choices=POOL_MODES,
+        help="Draw RB sequences from one pool per run, common gives every candidate "
+        "the same ones (executors whose rb_ondevice takes sequences, the "
+        "simulator; the qibocal one is refused)",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="full",
+        choices=REPORT_MODES,
+        help="Report of the run, summary keeps only the best and worst RB evaluations",
+    )
+    parser.add_argument(
+        "--background_report",
+        action="store_true",
+        help="Render the report while the results are saved",
+    )
+    parser.add_argument(
+        "--init",
+        type=str,
+        default="platform",
+        choices=list(INITIALIZERS),
+        help="Start from the platform values or from recent runs on the target",
+    )
+    return parser.parse_args(argv)
+
+
+def execute(args: Namespace):
+    from bayesopt_utils import rb_optimization, MAX_EVALUATIONS, BATCH_SIZE
+    from racing import race_history, committable
+
+    platform = args.platform
+    target = args.target
+    platform_update = args.platform_update
+
+    executor_path = Path.cwd().parent / "optimization_data" / f"{target}_bayesopt"
+    opt_history_path = Path.cwd().parent / "opt_analysis" / f"{target}_bayesopt"
+
+    # indexed before this run overwrites its own history
+    evaluations = INITIALIZERS[args.init](target)
+
+    start_time = time.time()
+    history = HistoryWriter(opt_history_path)
+    TRACER.open(opt_history_path, backend="bayesopt", target=target)
+
+    with open_executor(
+        "myexec",
+        path=executor_path,
+        platform=platform,
+        targets=[target],
+        update=platform_update,
+        force=True,
+    ) as e, open_pool(e, args.sequence_pool, opt_history_path):
+
+        e.platform.settings.nshots = NSHOTS
+        init_guess = initial_state(e, target, evaluations).x0
+        ampl_RX, freq_RX, beta_best = init_guess
+        # the GP models a local box around the coarse calibration
+        lower_bounds = np.array([0.9 * ampl_RX, freq_RX - 1e6, beta_best - 0.25])
+        upper_bounds = np.array([1.1 * ampl_RX, freq_RX + 1e6, beta_best + 0.25])
+
+        opt_results, optimization_history = rb_optimization(
+            e,
+            target,
+            init_guess,
+            zip(lower_bounds, upper_bounds),
+            max_evaluations=args.max_evaluations or MAX_EVALUATIONS,
+            batch_size=args.batch_size or BATCH_SIZE,
+            adaptive=args.adaptive,
+            history=history,
+        )
+        # the posterior minimum rests on single RB shots like the rest of the
+        # history, re-measure the best candidates before committing one
+        opt_results["race"] = race_history(e, target, optimization_history)
+        if platform_update and committable(opt_results["race"]):
+            update_platform(e, target, opt_results["race"].parameters)
+
+    history.close()
+    TRACER.close()
+    render_report(
+        e.path, e.history, [target], args.report, background=args.background_report
+    )
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+
+    save_results(opt_history_path, opt_results, optimization_history, elapsed_time)
+
+
+def main(argv=None):
+    execute(parse(argv))
+
+
+if __name__ == "__main__":
+    main()
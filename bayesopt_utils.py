@@ -0,0 +1,202 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+from scipy.stats import norm, qmc
+from qibocal.auto.execute import Executor
+from eval_cache import EvaluationCache
+from cma_utils import OptimizationStep, objective_batch, CACHE_RESOLUTION
+from tracing import phase
+
+INIT_POINTS = 8  # Latin hypercube points measured before the first GP fit
+MAX_EVALUATIONS = 40
+BATCH_SIZE = 4  # points proposed per acquisition round, measured in one job
+ACQUISITION_SAMPLES = 2048  # random candidates scanned before local refinement
+ACQUISITION_STARTS = 5  # best candidates refined with L-BFGS-B
+LENGTH_SCALE_BOUNDS = (1e-2, 10.0)  # in units of the normalized search box
+
+
+def matern52(x1, x2, length_scales):
+    d = np.sqrt((((x1[:, None, :] - x2[None, :, :]) / length_scales) ** 2).sum(axis=-1))
+    return (1 + np.sqrt(5) * d + 5 / 3 * d**2) * np.exp(-np.sqrt(5) * d)
+
+
+class HeteroscedasticGP:
+    """Gaussian process with a known, per-observation noise variance.
+
+    Inputs live in the unit box. Outputs are standardized, the noise is scaled
+    along, and the kernel hyperparameters maximize the marginal likelihood.
+    """
+
+    def __init__(
+        self, x, y, noise, length_scales=None, signal=1.0, offset=None, scale=None
+    ):
+        self.x = np.asarray(x, dtype=float)
+        self.offset = np.mean(y) if offset is None else offset
+        self.scale = (np.std(y) or 1.0) if scale is None else scale
+        self.y = (np.asarray(y) - self.offset) / self.scale
+        self.noise = np.asarray(noise) / self.scale**2
+        self.length_scales = (
+            np.full(self.x.shape[1], 0.3) if length_scales is None else length_scales
+        )
+        self.signal = signal
+        self._factorize()
+
+    def _factorize(self):
+        k = self.signal * matern52(self.x, self.x, self.length_scales)
+        k[np.diag_indices_from(k)] += self.noise + 1e-8
+        self.factor = cho_factor(k, lower=True)
+        self.alpha = cho_solve(self.factor, self.y)
+
+    def _neg_log_likelihood(self, theta):
+        self.length_scales, self.signal = np.exp(theta[:-1]), np.exp(theta[-1])
+        try:
+            self._factorize()
+        except np.linalg.LinAlgError:
+            return np.inf
+        log_det = 2 * np.log(np.diag(self.factor[0])).sum()
+        return 0.5 * (self.y @ self.alpha + log_det)
+
+    def fit(self):
+        log_bounds = [np.log(LENGTH_SCALE_BOUNDS)] * self.x.shape[1]
+        log_bounds.append((np.log(1e-2), np.log(1e2)))
+        theta0 = np.log([*self.length_scales, self.signal])
+        res = minimize(
+            self._neg_log_likelihood, theta0, method="L-BFGS-B", bounds=log_bounds
+        )
+        self._neg_log_likelihood(res.x if np.isfinite(res.fun) else theta0)
+        return self
+
+    def predict(self, x):
+        k = self.signal * matern52(np.atleast_2d(x), self.x, self.length_scales)
+        mean = k @ self.alpha
+        v = cho_solve(self.factor, k.T)
+        var = np.maximum(self.signal - (k * v.T).sum(axis=1), 1e-12)
+        return self.offset + self.scale * mean, self.scale * np.sqrt(var)
+
+    def condition(self, x, y, noise):
+        # same hyperparameters and standardization, one more observation
+        return HeteroscedasticGP(
+            np.vstack([self.x, x]),
+            np.append(self.offset + self.scale * self.y, y),
+            np.append(self.noise * self.scale**2, noise),
+            self.length_scales,
+            self.signal,
+            self.offset,
+            self.scale,
+        )
+
+
+def expected_improvement(gp, x, best):
+    mean, std = gp.predict(x)
+    z = (best - mean) / std
+    return (best - mean) * norm.cdf(z) + std * norm.pdf(z)
+
+
+def maximize_acquisition(gp, best, dim):
+    candidates = np.random.uniform(size=(ACQUISITION_SAMPLES, dim))
+    values = expected_improvement(gp, candidates, best)
+    starts = candidates[np.argsort(values)[-ACQUISITION_STARTS:]]
+
+    x_best, ei_best = starts[-1], values.max()
+    for x0 in starts:
+        res = minimize(
+            lambda x: -expected_improvement(gp, x, best)[0],
+            x0,
+            method="L-BFGS-B",
+            bounds=[(0, 1)] * dim,
+        )
+        if -res.fun > ei_best:
+            x_best, ei_best = res.x, -res.fun
+    return x_best
+
+
+def propose_batch(gp, batch_size, dim):
+    # kriging believer: each proposal is added at its predicted mean, so the
+    # next one is drawn away from it without a new measurement
+    best = gp.predict(gp.x)[0].min()
+    batch = []
+    for _ in range(batch_size):
+        x = maximize_acquisition(gp, best, dim)
+        batch.append(x)
+        gp = gp.condition(x, gp.predict(x)[0], noise=0.0)
+    return np.array(batch)
+
+
+def rb_optimization(
+    executor: Executor,
+    target: str,
+    init_guess: list[float],
+    bounds,
+    max_evaluations: int = MAX_EVALUATIONS,
+    batch_size: int = BATCH_SIZE,
+    adaptive: bool = False,
+    history=None,
+):
+
+    lower_bounds, upper_bounds = (np.array(b, dtype=float) for b in zip(*bounds))
+    span = upper_bounds - lower_bounds
+    dim = len(span)
+
+    optimization_history = []
+    cache = EvaluationCache(resolution=CACHE_RESOLUTION)
+    x_unit = np.empty((0, dim))
+    values, errors = [], []
+
+    def evaluate(points):
+        # the batch shares one hardware job when the executor supports it
+        solutions = list(lower_bounds + points * span)
+        function_values, function_errors = objective_batch(
+            solutions, executor, target, batch_size, cache, adaptive
+        )
+        for x, f, error in zip(solutions, function_values, function_errors):
+            step = OptimizationStep(
+                iteration=len(optimization_history),
+                parameters=np.copy(x),
+                objective_value=f,
+                objective_value_error=error,
+            )
+            optimization_history.append(step)
+            if history is not None:
+                history.append(step)
+            print(
+                f"Completed iteration {len(optimization_history)}, objective value: {f}"
+            )
+        return function_values, function_errors
+
+    init_unit = (np.asarray(init_guess, dtype=float) - lower_bounds) / span
+    design = qmc.LatinHypercube(d=dim, seed=np.random.randint(2**32)).random(
+        INIT_POINTS - 1
+    )
+    points = np.vstack([np.clip(init_unit, 0, 1), design])
+
+    while True:
+        function_values, function_errors = evaluate(points)
+        x_unit = np.vstack([x_unit, points])
+        values.extend(function_values)
+        errors.extend(function_errors)
+
+        y = np.array(values)
+        # failed fits carry no information, give them the spread of the data
+        noise = np.nan_to_num(np.array(errors, dtype=float) ** 2, nan=np.inf)
+        noise = np.minimum(noise, np.var(y) + 1e-12)
+        with phase("optimizer"):
+            gp = HeteroscedasticGP(x_unit, y, noise).fit()
+
+        remaining = max_evaluations - len(values)
+        if remaining <= 0:
+            break
+        with phase("optimizer"):
+            points = propose_batch(gp, min(batch_size, remaining), dim)
+
+    # noise-aware recommendation: lowest posterior mean among measured points
+    mean, std = gp.predict(x_unit)
+    best_idx = np.argmin(mean)
+    res = {
+        "x": lower_bounds + x_unit[best_idx] * span,
+        "fun": mean[best_idx],
+        "fun_std": std[best_idx],
+        "nfev": len(values),
+        "success": True,
+    }
+
+    return res, optimization_history
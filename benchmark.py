@@ -0,0 +1,257 @@
+import io
+import time
+import contextlib
+import numpy as np
+from argparse import ArgumentParser, Namespace
+from simulator import SimulatedExecutor, QubitModel
+from sequence_pool import open_pool, POOL_MODES
+from optuna_main import PRUNER_NAMES
+
+TARGET = "D1"
+TARGET_INFIDELITY = 1.5e-3
+NSHOTS = 2000
+
+
+def parse(argv=None) -> Namespace:
+    parser = ArgumentParser(
+        description="Benchmark the optimizers against a simulated RB device"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=list(BACKENDS),
+        choices=list(BACKENDS),
+        help="Optimizer backends to benchmark",
+    )
+    parser.add_argument(
+        "--repetitions", type=int, default=5, help="Independent runs per backend"
+    )
+    parser.add_argument(
+        "--target_infidelity",
+        type=float,
+        default=TARGET_INFIDELITY,
+        help="True gate infidelity that counts as calibrated",
+    )
+    parser.add_argument(
+        "--optuna_trials", type=int, default=100, help="Trials per Optuna study"
+    )
+    parser.add_argument(
+        "--adaptive", action="store_true", help="Use the sequential RB objective"
+    )
+    parser.add_argument(
+        "--pruner",
+        type=str,
+        choices=PRUNER_NAMES,
+        help="Pruner of the Optuna study (see optunaopt_utils)",
+    )
+    parser.add_argument(
+        "--sequence_pool",
+        type=str,
+        choices=POOL_MODES,
+        help="Draw RB sequences from one pool per run, common gives every candidate "
+        "the same ones",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Overlap the RB jobs with the classical work (cma and optuna)",
+    )
+    parser.add_argument(
+        "--realtime",
+        type=float,
+        default=0,
+        help="Sleep for the simulated hardware time, scaled by this factor",
+    )
+    parser.add_argument("--output", type=str, help="CSV file for the per-run results")
+    return parser.parse_args(argv)
+
+
+def run_cma(e, target, args):
+    from cma_utils import rb_optimization
+
+    e.platform.settings.nshots = NSHOTS
+    drag_output = e.drag_tuning(beta_start=-4, beta_end=4, beta_step=0.5)
+
+    beta_best = drag_output.results.betas[target]
+    ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
+    freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+
+    init_guess = np.array([ampl_RX, freq_RX, beta_best])
+    lower_bounds = np.array([-0.5, freq_RX - 4e6, beta_best - 0.25])
+    upper_bounds = np.array([0.5, freq_RX + 4e6, beta_best + 0.25])
+    rb_optimization(
+        e,
+        target,
+        init_guess,
+        zip(lower_bounds, upper_bounds),
+        adaptive=args.adaptive,
+        pipelined=args.pipelined,
+    )
+
+
+def run_nelder_mead(e, target, args):
+    from scipy.optimize import Bounds
+    from scipyopt_utils import rb_optimization
+
+    e.platform.settings.nshots = NSHOTS
+    ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
+    freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+
+    # same simplex layout as init_simplex.py, with typical fit uncertainties
+    sigma_ampl, sigma_freq = 1e-3, 5e5
+    init_guess = np.array([ampl_RX, freq_RX])
+    init_simplex = np.array(
+        [
+            [ampl_RX + sigma_ampl, freq_RX + sigma_freq],
+            [ampl_RX, freq_RX - sigma_freq],
+            [ampl_RX - sigma_ampl, freq_RX],
+        ]
+    )
+    bounds = Bounds([-0.5, freq_RX - 4e6], [0.5, freq_RX + 4e6])
+    rb_optimization(
+        e,
+        target,
+        "Nelder-Mead",
+        init_guess,
+        init_simplex,
+        bounds,
+        adaptive=args.adaptive,
+    )
+
+
+def run_optuna(e, target, args):
+    import optuna
+    from optunaopt_utils import rb_optimization
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    e.platform.settings.nshots = NSHOTS
+    ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
+    freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+
+    init_guess = {"amplitude": ampl_RX, "frequency": freq_RX}
+    bounds = [[-0.5, 0.5], [freq_RX - 4e6, freq_RX + 4e6]]
+    rb_optimization(
+        e,
+        target,
+        init_guess,
+        bounds,
+        study_name=f"benchmark_{time.time_ns()}",
+        storage=None,
+        n_trials=args.optuna_trials,
+        adaptive=args.adaptive,
+        pruner=args.pruner,
+        pipelined=args.pipelined,
+    )
+
+
+def run_bayesopt(e, target, args):
+    from bayesopt_utils import rb_optimization
+
+    e.platform.settings.nshots = NSHOTS
+    drag_output = e.drag_tuning(beta_start=-4, beta_end=4, beta_step=0.5)
+
+    beta_best = drag_output.results.betas[target]
+    ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
+    freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+
+    init_guess = np.array([ampl_RX, freq_RX, beta_best])
+    # the GP models a local box around the coarse calibration
+    lower_bounds = np.array([0.9 * ampl_RX, freq_RX - 1e6, beta_best - 0.25])
+    upper_bounds = np.array([1.1 * ampl_RX, freq_RX + 1e6, beta_best + 0.25])
+    rb_optimization(
+        e,
+        target,
+        init_guess,
+        zip(lower_bounds, upper_bounds),
+        adaptive=args.adaptive,
+    )
+
+
+BACKENDS = {
+    "cma": run_cma,
+    "nelder-mead": run_nelder_mead,
+    "optuna": run_optuna,
+    "bayesopt": run_bayesopt,
+}
+
+
+def benchmark_run(backend: str, seed: int, args: Namespace):
+    e = SimulatedExecutor({TARGET: QubitModel()}, seed=seed, realtime=args.realtime)
+    np.random.seed(seed)
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), open_pool(
+        e, args.sequence_pool, seed=seed
+    ):
+        BACKENDS[backend](e, TARGET, args)
+    elapsed_time = time.perf_counter() - start_time
+
+    # judged on the noise-free infidelity of every evaluated point
+    true_infidelities = np.array([ev.true_infidelity for ev in e.evaluations])
+    reached = np.flatnonzero(true_infidelities <= args.target_infidelity)
+    final = e.evaluations[-1]
+
+    return {
+        "backend": backend,
+        "seed": seed,
+        "evaluations": len(e.evaluations),
+        "sequences": sum(ev.sequences for ev in e.evaluations),
+        "evaluations_to_target": reached[0] + 1 if len(reached) else np.nan,
+        "best_infidelity": true_infidelities.min(),
+        "final_infidelity": final.true_infidelity,
+        "final_measured_infidelity": final.infidelity,
+        "compilations": e.compilations,
+        "hardware_time [s]": e.clock,
+        "wall_clock [s]": elapsed_time,
+        # share of the wall clock spent sleeping for the simulated hardware
+        "hardware_utilization": args.realtime * e.clock / elapsed_time,
+    }
+
+
+def summarize(runs):
+    grouped = runs.groupby("backend")
+    summary = grouped.agg(
+        evaluations=("evaluations", "mean"),
+        sequences=("sequences", "mean"),
+        compilations=("compilations", "mean"),
+        evaluations_to_target_mean=("evaluations_to_target", "mean"),
+        evaluations_to_target_std=("evaluations_to_target", "std"),
+        best_infidelity_mean=("best_infidelity", "mean"),
+        best_infidelity_std=("best_infidelity", "std"),
+        hardware_time_mean=("hardware_time [s]", "mean"),
+        hardware_time_std=("hardware_time [s]", "std"),
+        wall_clock_mean=("wall_clock [s]", "mean"),
+        wall_clock_std=("wall_clock [s]", "std"),
+        hardware_utilization=("hardware_utilization", "mean"),
+    )
+    summary["success_rate"] = grouped["evaluations_to_target"].apply(
+        lambda x: x.notna().mean()
+    )
+    return summary
+
+
+def main(argv=None):
+    args = parse(argv)
+
+    import pandas as pd
+
+    rows = []
+    for backend in args.backends:
+        for seed in range(args.repetitions):
+            row = benchmark_run(backend, seed, args)
+            print(
+                f"{backend} seed {seed}: {row['evaluations']} evaluations, "
+                f"best infidelity {row['best_infidelity']:.2e}"
+            )
+            rows.append(row)
+
+    runs = pd.DataFrame(rows)
+    if args.output:
+        runs.to_csv(args.output, index=False)
+
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(summarize(runs))
+
+
+if __name__ == "__main__":
+    main()
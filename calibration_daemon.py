@@ -0,0 +1,274 @@
+import datetime
+import importlib
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import time
+import traceback
+from argparse import ArgumentParser, REMAINDER, Namespace
+from contextlib import redirect_stdout, redirect_stderr
+from dataclasses import dataclass, asdict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from pathlib import Path
+from session import open_executor, use_executor
+
+# socket and key file live in a directory only the user running the service can
+# enter, the key can also come from the environment
+RUNTIME_DIR = (
+    Path(os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()))
+    / f"calibration_daemon-{os.getuid()}"
+)
+ADDRESS = str(RUNTIME_DIR / "daemon.sock")
+AUTHKEY_ENV = "CALIBRATION_DAEMON_KEY"
+AUTHKEY_FILE = RUNTIME_DIR / "authkey"
+LOG_DIR = Path.cwd().parent / "daemon_logs"  # one log per job
+POLL_INTERVAL = 1.0  # seconds between status requests of a waiting client
+
+# every driver takes its own command line arguments, the job budget included
+DRIVERS = {
+    "cma": "cma_main",
+    "scipy": "scipyopt_main",
+    "optuna": "optuna_main",
+    "bayesopt": "bayesopt_main",
+    "sequence": "sequence",
+}
+# imported once when the service starts, the clients load none of them
+PRELOAD = [
+    *DRIVERS.values(),
+    "cma_utils",
+    "scipyopt_utils",
+    "optunaopt_utils",
+    "bayesopt_utils",
+    "racing",
+    "qibocal.cli.report",
+]
+
+
+def private_dir(folder=RUNTIME_DIR):
+    folder.mkdir(mode=0o700, parents=True, exist_ok=True)
+    status = folder.stat()
+    if status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise PermissionError(f"{folder} must be owned by you with mode 0700")
+    return folder
+
+
+def load_authkey(create=False):
+    # the service writes a random key on its first start, clients read it
+    key = os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    private_dir(AUTHKEY_FILE.parent)
+    if create and not AUTHKEY_FILE.exists():
+        descriptor = os.open(AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, "w") as file:
+            file.write(secrets.token_hex(32))
+    return AUTHKEY_FILE.read_bytes()
+
+
+@dataclass
+class Job:
+    id: int
+    driver: str
+    argv: list
+    state: str = "queued"  # queued, running, done, failed
+    submitted: float = 0.0
+    started: float = None
+    finished: float = None
+    error: str = None
+
+
+class CalibrationDaemon:
+    """Resident calibration service with a single warm executor session.
+
+    Jobs are driver command lines (the same arguments the scripts take) and
+    run one at a time, in submission order, on the session that stays
+    connected to the instruments. Modules, compiled RB programs and the
+    platform are loaded once for every job.
+    """
+
+    def __init__(self, e, address=ADDRESS, authkey=None):
+        self.e = e
+        self.address = address
+        self.authkey = load_authkey(create=True) if authkey is None else authkey
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+
+    def submit(self, driver, argv):
+        if driver not in DRIVERS:
+            raise ValueError(
+                f"unknown driver {driver}, expected one of {list(DRIVERS)}"
+            )
+        job = Job(len(self.jobs), driver, list(argv), submitted=time.time())
+        self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def run_job(self, job):
+        job.state, job.started = "running", time.time()
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        with open(LOG_DIR / f"job_{job.id}_{job.driver}.log", "w") as log:
+            try:
+                # the redirection is process wide, the listener does not print
+                with redirect_stdout(log), redirect_stderr(log):
+                    importlib.import_module(DRIVERS[job.driver]).main(job.argv)
+                job.state = "done"
+            except (Exception, SystemExit):
+                # argparse exits on bad arguments, that only fails the job
+                job.state, job.error = "failed", traceback.format_exc()
+                log.write(job.error)
+        job.finished = time.time()
+
+    def work(self):
+        use_executor(self.e)
+        try:
+            while not self.stopped.is_set():
+                try:
+                    job = self.queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                self.run_job(job)
+        finally:
+            use_executor(None)
+
+    def handle(self, request):
+        command = request["command"]
+        if command == "submit":
+            return asdict(self.submit(request["driver"], request["argv"]))
+        if command == "status":
+            return [asdict(job) for job in self.jobs.values()]
+        if command == "shutdown":
+            # the running job finishes, the queued ones are dropped
+            self.stopped.set()
+            return "stopping"
+        raise ValueError(f"unknown command {command}")
+
+    def respond(self, connection):
+        # a client that goes away only loses its own reply
+        try:
+            request = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = ("ok", self.handle(request))
+        except Exception as error:
+            reply = ("error", repr(error))
+        try:
+            connection.send(reply)
+        except OSError:
+            pass
+
+    def serve(self):
+        for module in PRELOAD:
+            importlib.import_module(module)
+        worker = threading.Thread(target=self.work, name="calibration")
+        worker.start()
+        try:
+            private_dir(Path(self.address).parent)
+            Path(self.address).unlink(missing_ok=True)
+            with Listener(self.address, "AF_UNIX", authkey=self.authkey) as listener:
+                while not self.stopped.is_set():
+                    try:
+                        connection = listener.accept()
+                    except (AuthenticationError, EOFError, OSError):
+                        # wrong key, or the client left during the handshake
+                        continue
+                    with connection:
+                        self.respond(connection)
+        finally:
+            # on interrupts too, the running job ends before the session closes
+            self.stopped.set()
+            worker.join()
+
+
+def request(command, address=ADDRESS, authkey=None, **kwargs):
+    if authkey is None:
+        authkey = load_authkey()
+    with Client(address, "AF_UNIX", authkey=authkey) as connection:
+        connection.send({"command": command, **kwargs})
+        status, reply = connection.recv()
+    if status == "error":
+        raise RuntimeError(reply)
+    return reply
+
+
+def wait(job_id, address=ADDRESS):
+    while True:
+        job = request("status", address)[job_id]
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(POLL_INTERVAL)
+
+
+def parse(argv=None) -> Namespace:
+    parser = ArgumentParser(description="Resident calibration service and client")
+    parser.add_argument(
+        "--address",
+        type=str,
+        default=ADDRESS,
+        help="Local socket, in a directory only you can enter (mode 0700)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Open the session and accept jobs")
+    serve.add_argument(
+        "--platform", type=str, required=True, help="Platform identifier"
+    )
+    serve.add_argument(
+        "--targets", nargs="+", required=True, help="Qubits the session starts with"
+    )
+    serve.add_argument(
+        "--platform_update", action="store_true", help="Enable platform update"
+    )
+
+    submit = commands.add_parser("submit", help="Queue a driver run")
+    submit.add_argument("driver", type=str, choices=list(DRIVERS))
+    submit.add_argument("--wait", action="store_true", help="Block until it ends")
+    submit.add_argument("argv", nargs=REMAINDER, help="Arguments of the driver")
+
+    commands.add_parser("status", help="List the jobs of the session")
+    commands.add_parser("shutdown", help="Close the session after the running job")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse(argv)
+
+    if args.command == "serve":
+        formatted_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = Path.cwd().parent / "optimization_data" / f"daemon_{formatted_time}"
+        with open_executor(
+            "myexec",
+            path=path,
+            platform=args.platform,
+            targets=args.targets,
+            update=args.platform_update,
+        ) as e:
+            CalibrationDaemon(e, args.address).serve()
+        return
+
+    if args.command == "submit":
+        job = request("submit", args.address, driver=args.driver, argv=args.argv)
+        print(f"job {job['id']} queued")
+        if args.wait:
+            job = wait(job["id"], args.address)
+            print(f"job {job['id']} {job['state']}")
+            if job["error"] is not None:
+                print(job["error"])
+        return
+
+    reply = request(args.command, args.address)
+    if args.command == "status":
+        for job in reply:
+            print(
+                f"{job['id']}\t{job['driver']}\t{job['state']}\t{' '.join(job['argv'])}"
+            )
+    else:
+        print(reply)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import pickle
+from pathlib import Path
+
+CHECKPOINT_FILE = "checkpoint.pkl"
+
+
+class Checkpoint:
+    """Optimizer state of a run, pickled next to its optimization history.
+
+    Backends keep ``state`` up to date and call ``save`` whenever a new
+    measurement would otherwise be lost; the file is replaced atomically, so
+    an interrupt during ``save`` leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, folder):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        self.path = Path(folder) / CHECKPOINT_FILE
+        self.state = {}
+
+    def update(self, **state):
+        self.state.update(state)
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def load_checkpoint(folder):
+    path = Path(folder) / CHECKPOINT_FILE
+    if not path.exists():
+        raise FileNotFoundError(f"No checkpoint to resume in {folder}")
+    with open(path, "rb") as f:
+        return pickle.load(f)
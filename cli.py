@@ -0,0 +1,41 @@
+import importlib
+import sys
+from argparse import ArgumentParser, RawDescriptionHelpFormatter, REMAINDER
+
+# command: (module, description), a module is imported only when its command runs
+COMMANDS = {
+    "cma": ("cma_main", "Fine tuning calibration using CMA-ES"),
+    "scipy": ("scipyopt_main", "Fine tuning calibration using scipy minimize"),
+    "optuna": ("optuna_main", "Fine tuning calibration using Optuna"),
+    "bayesopt": ("bayesopt_main", "Fine tuning calibration using BayesOpt"),
+    "sequence": ("sequence", "Ramsey and closed-loop flipping calibration"),
+    "daemon": ("calibration_daemon", "Resident calibration service and client"),
+    "report": ("reporting", "Render the report of a saved executor run"),
+    "summary": ("summary", "Summarize optimization runs and studies"),
+    "results": ("results_store", "Convert runs and studies to Parquet"),
+    "trace": ("tracing", "Summarize the phase trace of a run"),
+    "benchmark": ("benchmark", "Benchmark the optimizers on the simulator"),
+}
+
+
+def parse(argv=None):
+    parser = ArgumentParser(
+        description="Calibration tools, the arguments after the command are its own",
+        epilog="\n".join(f"{name:<10} {text}" for name, (_, text) in COMMANDS.items()),
+        formatter_class=RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=list(COMMANDS), metavar="command")
+    parser.add_argument("args", nargs=REMAINDER, help="Arguments of the command")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse(argv)
+    module = importlib.import_module(COMMANDS[args.command][0])
+    # usage lines of the command read "cli.py <command> ..."
+    sys.argv[0] = f"{sys.argv[0]} {args.command}"
+    module.main(args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,79 +4,186 @@ import time
 import pickle
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
-from qibocal.auto.execute import Executor
-from qibocal import update
-from qibocal.cli.report import report
-from cma_utils import rb_optimization
+from session import open_executor, keep_rx
+from history import HistoryWriter
+from checkpoint import Checkpoint, load_checkpoint
+from tracing import TRACER
+from warm_start import initial_state, INITIALIZERS
+from reporting import render_report, REPORT_MODES
+from sequence_pool import open_pool, POOL_MODES
 
 NSHOTS = 2000
+# options of single-target runs, a multiplexed run starts fresh from the platform
+SINGLE_TARGET = ("resume", "adaptive", "batched", "pipelined")
 
 
-def parse() -> Namespace:
+def parse(argv=None) -> Namespace:
     parser = ArgumentParser(description="Fine tuning calibration using cma algorithm")
     parser.add_argument(
         "--platform", type=str, required=True, help="Platform identifier"
     )
-    parser.add_argument(
-        "--target", type=str, required=True, help="Target qubit to be calibrated"
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument("--target", type=str, help="Target qubit to be calibrated")
+    targets.add_argument(
+        "--targets",
+        type=str,
+        nargs="+",
+        help="Target qubits calibrated together, one optimizer per qubit",
     )
     parser.add_argument(
         "--platform_update", action="store_true", help="Enable platform update"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--batched",
+        action="store_true",
+        help="Evaluate each CMA-ES generation as one batched RB job (simulator "
+        "only, the qibocal executor runs one RB experiment per job)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Run RB in increments until the error bar is small enough",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Queue the next RB job while the last one is fitted",
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        help="Run folder in opt_analysis to continue from its checkpoint",
+    )
+    parser.add_argument(
+        "--sequence_pool",
+        type=str,
+        choices=POOL_MODES,
+        help="Draw RB sequences from one pool per run, common gives every candidate "
+        "the same ones (executors whose rb_ondevice takes sequences, the "
+        "simulator; the qibocal one is refused)",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="full",
+        choices=REPORT_MODES,
+        help="Report of the run, summary keeps only the best and worst RB evaluations",
+    )
+    parser.add_argument(
+        "--background_report",
+        action="store_true",
+        help="Render the report while the results are saved",
+    )
+    parser.add_argument(
+        "--init",
+        type=str,
+        default="platform",
+        choices=list(INITIALIZERS),
+        help="Start from the platform values or from recent runs on the target",
+    )
+    args = parser.parse_args(argv)
+    if args.targets is not None:
+        ignored = [f"--{name}" for name in SINGLE_TARGET if getattr(args, name)]
+        if args.init != "platform":
+            ignored.append("--init")
+        if ignored:
+            parser.error(f"--targets does not support {', '.join(ignored)}")
+    return args
 
 
-def update_platform(
-    args: Namespace,
-    params: list[float],
-):
-    platform = args.platform
-    target = args.target
+def update_platform(e, target: str, params: list[float]):
+    # commits to the platform of the open session, which saves it on close
+    from qibocal import update
+
     amplitude, frequency, beta = params
-    update.drive_amplitude(amplitude, platform, target)
-    update.drive_frequency(frequency, platform, target)
-    update.drag_pulse_beta(beta, platform, target)
+    update.drive_amplitude(amplitude, e.platform, target)
+    update.drive_frequency(frequency, e.platform, target)
+    update.drag_pulse_beta(beta, e.platform, target)
+    keep_rx(e, target)
 
 
 def execute(args: Namespace):
+    from cma_utils import rb_optimization
+    from racing import race_history, committable
+
     platform = args.platform
     target = args.target
     platform_update = args.platform_update
+    adaptive = args.adaptive
+    batched = args.batched
 
     executor_path = Path.cwd().parent / "optimization_data" / f"{target}_cma_test"
     opt_history_path = Path.cwd().parent / "opt_analysis" / f"{target}_cma_test"
 
+    resume = None
+    if args.resume is not None:
+        # keep the data of the interrupted run, write the new session next to it
+        executor_path = (
+            Path.cwd().parent / "optimization_data" / f"{args.resume}_resumed"
+        )
+        opt_history_path = Path.cwd().parent / "opt_analysis" / args.resume
+        resume = load_checkpoint(opt_history_path)
+    # indexed before this run overwrites its own history
+    evaluations = INITIALIZERS[args.init](target) if resume is None else None
+
     start_time = time.time()
+    history = HistoryWriter(opt_history_path, resume=resume is not None)
+    checkpoint = Checkpoint(opt_history_path)
+    TRACER.open(opt_history_path, backend="cma", target=target)
 
-    with Executor.open(
+    with open_executor(
         "myexec",
         path=executor_path,
         platform=platform,
         targets=[target],
         update=platform_update,
         force=True,
-    ) as e:
+    ) as e, open_pool(e, args.sequence_pool, opt_history_path):
 
         e.platform.settings.nshots = NSHOTS
-        drag_output = e.drag_tuning(beta_start=-4, beta_end=4, beta_step=0.5)
-
-        beta_best = drag_output.results.betas[target]
-        ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
-        freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+        init_stds = None
+        if resume is None:
+            start = initial_state(e, target, evaluations)
+            init_guess, init_stds = start.x0, start.stds
+            _, freq_RX, beta_best = init_guess
 
-        init_guess = np.array([ampl_RX, freq_RX, beta_best])
-        lower_bounds = np.array([-0.5, freq_RX - 4e6, beta_best - 0.25])
-        upper_bounds = np.array([0.5, freq_RX + 4e6, beta_best + 0.25])
-        bounds = zip(lower_bounds, upper_bounds)
+            lower_bounds = np.array([-0.5, freq_RX - 4e6, beta_best - 0.25])
+            upper_bounds = np.array([0.5, freq_RX + 4e6, beta_best + 0.25])
+            bounds = zip(lower_bounds, upper_bounds)
+        else:
+            init_guess, bounds = resume["init_guess"], resume["bounds"]
+            init_stds = resume.get("init_stds")
 
         opt_results, optimization_history = rb_optimization(
-            e, target, init_guess, bounds
+            e,
+            target,
+            init_guess,
+            bounds,
+            batched=batched,
+            adaptive=adaptive,
+            pipelined=args.pipelined,
+            init_stds=init_stds,
+            history=history,
+            checkpoint=checkpoint,
+            resume=resume,
         )
+        # re-measure the best candidates before committing one of them
+        opt_results["race"] = race_history(e, target, optimization_history)
+        if platform_update and committable(opt_results["race"]):
+            update_platform(e, target, opt_results["race"].parameters)
 
-    report(e.path, e.history)
+    history.close()
+    TRACER.close()
+    render_report(
+        e.path, e.history, [target], args.report, background=args.background_report
+    )
     end_time = time.time()
     elapsed_time = end_time - start_time
 
+    save_results(opt_history_path, opt_results, optimization_history, elapsed_time)
+
+
+def save_results(opt_history_path, opt_results, optimization_history, elapsed_time):
     # Save optimization_history as .npz
     iterations = np.array([step.iteration for step in optimization_history])
     parameters = np.array([step.parameters for step in optimization_history])
@@ -98,23 +205,87 @@ def execute(args: Namespace):
     with open(os.path.join(opt_history_path, "optimization_result.pkl"), "wb") as f:
         pickle.dump(data_stored, f)
 
-    # Update platform to best parameters result
-    fidelities = 1 - objective_values
-    sorted_indices_desc = np.argsort(fidelities)[::-1]
 
-    sorted_fidelities = fidelities[sorted_indices_desc]
-    sorted_errors = objective_value_error[sorted_indices_desc]
-    sorted_parameters = parameters[sorted_indices_desc]
+def execute_multi(args: Namespace):
+    from cma_utils import rb_optimization_multi
+    from racing import race_history, committable
+
+    platform = args.platform
+    targets = args.targets
+    platform_update = args.platform_update
+
+    name = "_".join(targets)
+    executor_path = Path.cwd().parent / "optimization_data" / f"{name}_cma_multi"
+    opt_history_paths = {
+        target: Path.cwd().parent / "opt_analysis" / f"{target}_cma_multi"
+        for target in targets
+    }
+
+    start_time = time.time()
+    histories = {
+        target: HistoryWriter(path) for target, path in opt_history_paths.items()
+    }
+    # multiplexed jobs are shared by every target, one trace for the session
+    TRACER.open(Path.cwd().parent / "opt_analysis" / f"{name}_cma_multi", backend="cma")
+
+    with open_executor(
+        "myexec",
+        path=executor_path,
+        platform=platform,
+        targets=targets,
+        update=platform_update,
+        force=True,
+    ) as e, open_pool(e, args.sequence_pool, opt_history_paths[targets[0]]):
+
+        e.platform.settings.nshots = NSHOTS
+        # a single drag_tuning run covers every target
+        drag_output = e.drag_tuning(beta_start=-4, beta_end=4, beta_step=0.5)
+
+        init_guesses, bounds = {}, {}
+        for target in targets:
+            beta_best = drag_output.results.betas[target]
+            ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
+            freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+
+            init_guesses[target] = np.array([ampl_RX, freq_RX, beta_best])
+            lower_bounds = np.array([-0.5, freq_RX - 4e6, beta_best - 0.25])
+            upper_bounds = np.array([0.5, freq_RX + 4e6, beta_best + 0.25])
+            bounds[target] = list(zip(lower_bounds, upper_bounds))
 
-    try:
-        idx = np.flatnonzero(sorted_fidelities + sorted_errors > 1)[0]
-        update_platform(Namespace, sorted_parameters[idx])
-    except IndexError:
-        pass
+        opt_results, optimization_history = rb_optimization_multi(
+            e, targets, init_guesses, bounds, histories=histories
+        )
+        for target in targets:
+            opt_results[target]["race"] = race_history(
+                e, target, optimization_history[target]
+            )
+            if platform_update and committable(opt_results[target]["race"]):
+                update_platform(e, target, opt_results[target]["race"].parameters)
+
+    for history in histories.values():
+        history.close()
+    TRACER.close()
+    render_report(
+        e.path, e.history, targets, args.report, background=args.background_report
+    )
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+
+    for target in targets:
+        save_results(
+            opt_history_paths[target],
+            opt_results[target],
+            optimization_history[target],
+            elapsed_time,
+        )
 
 
-def main():
-    execute(parse())
+def main(argv=None):
+    args = parse(argv)
+    if args.targets is not None:
+        execute_multi(args)
+    else:
+        execute(args)
 
 
 if __name__ == "__main__":
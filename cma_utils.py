@@ -1,14 +1,26 @@
+import asyncio
 import numpy as np
 import cma
+import pickle
 from qibocal.auto.execute import Executor
 from qibolab import pulses
 from dataclasses import dataclass
+from eval_cache import EvaluationCache, CachedEvaluation
+from adaptive_rb import sequential_rb, SequentialEstimate, SEQUENCES_STEP
+from rb_fit import rb_infidelity
+from program_cache import rb_ondevice
+from sequence_pool import pool_arguments
+from tracing import phase, evaluation
+from parameter_space import ParameterSpace
+from pipeline import RBPipeline
 
 DELTA = 10
 MAX_DEPTH = 1000
 AVG_GATE = 1.875  # 1.875 is the average number of gates in a Clifford operation
 SEQUENCES = 1000
-INIT_STD = 0.25
+INIT_STD = 1.0  # in units of the parameter scales, see parameter_space
+BATCH_SIZE = None  # candidates per hardware job, None runs the whole generation
+CACHE_RESOLUTION = None  # parameter quanta of the evaluation cache, None is exact
 
 error_storage = {"error": None}
 
@@ -21,35 +33,133 @@ class OptimizationStep:
     objective_value_error: float
 
 
+def set_rx_parameters(e, target, params):
+    amplitude, frequency, *beta = params
+
+    with phase("parameter_update"):
+        e.platform.qubits[target].native_gates.RX.amplitude = amplitude
+        e.platform.qubits[target].native_gates.RX.frequency = frequency
+
+    # beta parameter for DRAG pulse, when optimized
+    if beta:
+        with phase("shape_rebuild"):
+            pulse = e.platform.qubits[target].native_gates.RX.pulse(start=0)
+            rel_sigma = pulse.shape.rel_sigma
+            drag_pulse = pulses.Drag(rel_sigma=rel_sigma, beta=beta[0])
+            e.platform.qubits[target].native_gates.RX.shape = repr(drag_pulse)
+
+
+def measure(params, e, target, incumbent=None, adaptive=False):
+    set_rx_parameters(e, target, params)
+
+    if adaptive:
+        return sequential_rb(e, target, MAX_DEPTH, DELTA, incumbent)
+
+    with phase("rb_ondevice"):
+        rb_output = rb_ondevice(
+            e,
+            num_of_sequences=SEQUENCES,
+            max_circuit_depth=MAX_DEPTH,
+            delta_clifford=DELTA,
+            n_avg=1,
+            save_sequences=True,
+            apply_inverse=True,
+        )
+
+    return rb_infidelity(rb_output, target)
+
+
+def measure_multiplexed(params, e):
+    # params maps each target to its candidate, all of them are measured in the
+    # same RB job and the fit results are demultiplexed per target
+    for target, target_params in params.items():
+        set_rx_parameters(e, target, target_params)
+
+    with phase("rb_ondevice"):
+        rb_output = rb_ondevice(
+            e,
+            num_of_sequences=SEQUENCES,
+            max_circuit_depth=MAX_DEPTH,
+            delta_clifford=DELTA,
+            n_avg=1,
+            save_sequences=True,
+            apply_inverse=True,
+        )
+
+    return {target: rb_infidelity(rb_output, target) for target in params}
+
+
+def measure_batch(
+    solutions,
+    e,
+    target,
+    batch_size=BATCH_SIZE,
+    incumbent=None,
+    adaptive=False,
+    sequences=SEQUENCES,
+):
+    # candidates are described by the same RX fields set_rx_parameters would set
+    with phase("shape_rebuild"):
+        rx = e.platform.qubits[target].native_gates.RX
+        rel_sigma = rx.pulse(start=0).shape.rel_sigma
+        candidates = []
+        for amplitude, frequency, *beta in solutions:
+            shape = rx.shape
+            if beta:
+                shape = repr(pulses.Drag(rel_sigma=rel_sigma, beta=beta[0]))
+            candidates.append(
+                {"amplitude": amplitude, "frequency": frequency, "shape": shape}
+            )
+
+    def run(indices, sequences):
+        size = batch_size or len(indices)
+        results = []
+        for start in range(0, len(indices), size):
+            kwargs = pool_arguments(
+                e,
+                dict(
+                    num_of_sequences=sequences,
+                    max_circuit_depth=MAX_DEPTH,
+                    delta_clifford=DELTA,
+                    n_avg=1,
+                    save_sequences=True,
+                    apply_inverse=True,
+                ),
+                batch=True,
+            )
+            with phase("rb_ondevice"):
+                rb_outputs = e.rb_ondevice_batch(
+                    [candidates[i] for i in indices[start : start + size]],
+                    target=target,
+                    **kwargs,
+                )
+            results.extend(rb_infidelity(rb_output, target) for rb_output in rb_outputs)
+        return results
+
+    if not adaptive:
+        return run(list(range(len(candidates))), sequences)
+
+    # increments are batched over the candidates that are still running
+    estimates = [SequentialEstimate() for _ in candidates]
+    active = list(range(len(candidates)))
+    while active:
+        for i, (r_g, r_g_std) in zip(active, run(active, SEQUENCES_STEP)):
+            estimates[i].add(r_g, r_g_std, SEQUENCES_STEP)
+        active = [i for i in active if not estimates[i].done(incumbent)]
+    return [(estimate.infidelity, estimate.error) for estimate in estimates]
+
+
 # Objective function to minimize
-def objective(params, e, target):
-    amplitude, frequency, beta = params
-
-    e.platform.qubits[target].native_gates.RX.amplitude = amplitude
-    e.platform.qubits[target].native_gates.RX.frequency = frequency
-
-    pulse = e.platform.qubits[target].native_gates.RX.pulse(start=0)
-    rel_sigma = pulse.shape.rel_sigma
-    drag_pulse = pulses.Drag(rel_sigma=rel_sigma, beta=beta)
-    e.platform.qubits[target].native_gates.RX.shape = repr(drag_pulse)
-
-    rb_output = e.rb_ondevice(
-        num_of_sequences=SEQUENCES,
-        max_circuit_depth=MAX_DEPTH,
-        delta_clifford=DELTA,
-        n_avg=1,
-        save_sequences=True,
-        apply_inverse=True,
-    )
-
-    # Calculate infidelity and error
-    stdevs = np.sqrt(np.diag(np.reshape(rb_output.results.cov[target], (3, 3))))
-    pars = rb_output.results.pars.get(target)
-    one_minus_p = 1 - pars[2]
-    r_c = one_minus_p * (1 - 1 / 2**1)
-    r_g = r_c / AVG_GATE
-    r_c_std = stdevs[2] * (1 - 1 / 2**1)
-    r_g_std = r_c_std / AVG_GATE
+def objective(params, e, target, cache=None, adaptive=False):
+    with evaluation():
+        if cache is None:
+            r_g, r_g_std = measure(params, e, target, adaptive=adaptive)
+        else:
+            incumbent = None if cache.best is None else cache.best.infidelity
+            entry = cache.evaluate(
+                params, lambda: measure(params, e, target, incumbent, adaptive)
+            )
+            r_g, r_g_std = entry.infidelity, entry.error
 
     error_storage["error"] = r_g_std
 
@@ -57,50 +167,197 @@ def objective(params, e, target):
     return r_g
 
 
-def rb_optimization(executor: Executor, target: str, init_guess: list[float], bounds):
+def objective_serial(solutions, e, target, cache=None, adaptive=False):
+    function_values, errors = [], []
+    for sol in solutions:
+        function_values.append(objective(sol, e, target, cache, adaptive))
+        errors.append(error_storage["error"])
+    return function_values, errors
+
+
+# Evaluate a whole population, one hardware job per chunk of BATCH_SIZE candidates
+def objective_batch(
+    solutions, e, target, batch_size=BATCH_SIZE, cache=None, adaptive=False
+):
+    if not hasattr(e, "rb_ondevice_batch"):
+        # executor can only run one RB experiment per job (the qibocal one),
+        # rb_optimization refuses batched=True on it
+        return objective_serial(solutions, e, target, cache, adaptive)
+
+    entries = [None if cache is None else cache.get(sol) for sol in solutions]
+    pending = [i for i, entry in enumerate(entries) if entry is None]
+    if pending:
+        incumbent = None
+        if cache is not None and cache.best is not None:
+            incumbent = cache.best.infidelity
+        with evaluation():
+            measured = measure_batch(
+                [solutions[i] for i in pending],
+                e,
+                target,
+                batch_size,
+                incumbent,
+                adaptive,
+            )
+        for i, (r_g, r_g_std) in zip(pending, measured):
+            if cache is None:
+                entries[i] = CachedEvaluation(r_g, r_g_std, run_id=None)
+            else:
+                entries[i] = cache.put(solutions[i], r_g, r_g_std)
+
+    print(f"terminating batched objective call ({len(pending)} candidates measured)")
+    return [entry.infidelity for entry in entries], [entry.error for entry in entries]
+
+
+# Evaluate a population one RB job per candidate, the next job queued while the
+# last output is fitted
+def objective_pipelined(solutions, pipeline):
+    entries = asyncio.run(pipeline.map(solutions))
+    print(f"terminating pipelined objective call ({len(solutions)} candidates)")
+    return [entry.infidelity for entry in entries], [entry.error for entry in entries]
+
+
+def rb_optimization(
+    executor: Executor,
+    target: str,
+    init_guess: list[float],
+    bounds,
+    batched: bool = False,
+    adaptive: bool = False,
+    pipelined: bool = False,
+    init_stds=None,
+    history=None,
+    checkpoint=None,
+    resume=None,
+):
+    if batched and not hasattr(executor, "rb_ondevice_batch"):
+        # the qibocal Executor runs one RB experiment per job
+        raise ValueError("the executor cannot run batched RB jobs")
 
     optimization_history = []
     iteration_count = 0
+    cache = EvaluationCache(resolution=CACHE_RESOLUTION)
+    if resume is not None:
+        # continue from the state saved by a previous, interrupted run
+        optimization_history = resume["optimization_history"]
+        iteration_count = len(optimization_history)
+        cache = resume["cache"]
+    if checkpoint is not None:
+        cache.on_put = checkpoint.save
+    if pipelined and (batched or adaptive):
+        raise ValueError(
+            "pipelined evaluation runs one fixed-size RB job per candidate"
+        )
+    pipeline = None
 
-    def record_history(x, f):
+    def record_history(x, f, error=None):
         nonlocal iteration_count
         if f is None:
-            # If the optimization method doesn't provide f, need to calculate it
-            f = objective(x, executor, target)
+            # If the optimization method doesn't provide f, look it up in the cache
+            f = objective(x, executor, target, cache, adaptive)
+        if error is None:
+            error = error_storage["error"]
 
         step = OptimizationStep(
             iteration=iteration_count,
             parameters=np.copy(x),
             objective_value=f,
-            objective_value_error=error_storage["error"],
+            objective_value_error=error,
         )
         optimization_history.append(step)
+        if history is not None:
+            history.append(step)
         iteration_count += 1
         print(f"Completed iteration {iteration_count}, objective value: {f}")
 
     sigma = INIT_STD  # Standard deviation for initial search
     lower_bounds, upper_bounds = zip(*bounds)
+    # CMA-ES works on normalized coordinates, scaled by the spread of a warm
+    # start when there is one
+    space = ParameterSpace(init_guess, zip(lower_bounds, upper_bounds), init_stds)
+    unit_lower, unit_upper = zip(*space.unit_bounds)
 
-    # Create a CMA-ES optimizer instance
-    es = cma.CMAEvolutionStrategy(
-        init_guess, sigma, {"bounds": [lower_bounds, upper_bounds], "maxiter": 3}
-    )
+    if resume is None:
+        # Create a CMA-ES optimizer instance
+        es = cma.CMAEvolutionStrategy(
+            np.zeros(len(space.center)),
+            sigma,
+            {"bounds": [unit_lower, unit_upper], "maxiter": 3},
+        )
+    else:
+        # es.ask draws from the global numpy generator, restoring it makes the
+        # interrupted generation ask the same solutions, answered by the cache
+        es = pickle.loads(resume["es"])
+        np.random.set_state(resume["random_state"])
+
+    if checkpoint is not None:
+        checkpoint.update(
+            backend="cma",
+            init_guess=np.asarray(init_guess),
+            bounds=list(zip(lower_bounds, upper_bounds)),
+            init_stds=init_stds,
+            cache=cache,
+            optimization_history=optimization_history,
+        )
 
     # Optimization loop (testing this instead of es.optimize)
-    while not es.stop():
-        solutions = es.ask()
+    try:
+        # built here so that the finally below always closes it
+        if pipelined:
+            pipeline = RBPipeline(
+                executor,
+                target,
+                cache,
+                num_of_sequences=SEQUENCES,
+                max_circuit_depth=MAX_DEPTH,
+                delta_clifford=DELTA,
+                n_avg=1,
+                save_sequences=True,
+                apply_inverse=True,
+            )
+        while not es.stop():
+            if checkpoint is not None:
+                checkpoint.update(
+                    es=pickle.dumps(es), random_state=np.random.get_state()
+                )
+                checkpoint.save()
+            with phase("optimizer"):
+                solutions = es.ask()
+            candidates = [space.from_unit(u) for u in solutions]
 
-        # Evaluate the objective function for each solution
-        function_values = [objective(sol, executor, target) for sol in solutions]
-        es.tell(solutions, function_values)
+            # Evaluate the objective function for each solution
+            if batched:
+                function_values, errors = objective_batch(
+                    candidates, executor, target, cache=cache, adaptive=adaptive
+                )
+            elif pipelined:
+                function_values, errors = objective_pipelined(candidates, pipeline)
+            else:
+                function_values, errors = objective_serial(
+                    candidates, executor, target, cache, adaptive
+                )
+            with phase("optimizer"):
+                es.tell(solutions, function_values)
 
-        # Record history for the best solution of the current iteration
-        best_idx = np.argmin(function_values)
-        record_history(solutions[best_idx], function_values[best_idx])
+            # Record history for the best solution of the current iteration
+            best_idx = np.argmin(function_values)
+            record_history(
+                candidates[best_idx], function_values[best_idx], errors[best_idx]
+            )
+    finally:
+        # the worker thread and the switch interval must not outlive the run
+        if pipeline is not None:
+            pipeline.close()
+
+    if checkpoint is not None:
+        checkpoint.update(es=pickle.dumps(es), random_state=np.random.get_state())
+        checkpoint.save()
+    if pipeline is not None:
+        print(f"hardware busy {pipeline.utilization:.1%} of the optimization")
 
     # Retrieve the final result - not strictly necessary but useful to keep track of the history similarly to scipy optimize
     res = {
-        "x": es.result.xbest,  # Best solution found
+        "x": space.from_unit(es.result.xbest),  # Best solution found
         "fun": es.result.fbest,  # Objective value at the best solution
         "nfev": es.result.evaluations,  # Number of function evaluations
         "nit": es.result.iterations,  # Number of iterations
@@ -108,3 +365,87 @@ def rb_optimization(executor: Executor, target: str, init_guess: list[float], bo
     }
 
     return res, optimization_history
+
+
+def rb_optimization_multi(
+    executor: Executor,
+    targets: list[str],
+    init_guesses: dict,
+    bounds: dict,
+    histories: dict = None,
+):
+    # one independent CMA-ES per target, run in lockstep so that the i-th
+    # candidate of every target shares one multiplexed RB job
+    strategies, spaces = {}, {}
+    for target in targets:
+        spaces[target] = ParameterSpace(init_guesses[target], bounds[target])
+        unit_lower, unit_upper = zip(*spaces[target].unit_bounds)
+        strategies[target] = cma.CMAEvolutionStrategy(
+            np.zeros(len(spaces[target].center)),
+            INIT_STD,
+            {"bounds": [unit_lower, unit_upper], "maxiter": 3},
+        )
+    caches = {
+        target: EvaluationCache(resolution=CACHE_RESOLUTION) for target in targets
+    }
+    optimization_history = {target: [] for target in targets}
+
+    while True:
+        active = [target for target in targets if not strategies[target].stop()]
+        if not active:
+            break
+        with phase("optimizer"):
+            solutions = {target: strategies[target].ask() for target in active}
+        parameters = {
+            target: [spaces[target].from_unit(u) for u in solutions[target]]
+            for target in active
+        }
+        entries = {target: [] for target in active}
+
+        popsize = max(len(solutions[target]) for target in active)
+        for i in range(popsize):
+            candidates = {
+                target: parameters[target][i]
+                for target in active
+                if i < len(solutions[target])
+            }
+            found = {target: caches[target].get(x) for target, x in candidates.items()}
+            pending = {t: candidates[t] for t, entry in found.items() if entry is None}
+            if pending:
+                with evaluation():
+                    results = measure_multiplexed(pending, executor)
+                for target, result in results.items():
+                    found[target] = caches[target].put(pending[target], *result)
+            for target, entry in found.items():
+                entries[target].append(entry)
+
+        for target in active:
+            function_values = [entry.infidelity for entry in entries[target]]
+            with phase("optimizer"):
+                strategies[target].tell(solutions[target], function_values)
+
+            # Record history for the best solution of the current iteration
+            best_idx = np.argmin(function_values)
+            step = OptimizationStep(
+                iteration=len(optimization_history[target]),
+                parameters=np.copy(parameters[target][best_idx]),
+                objective_value=function_values[best_idx],
+                objective_value_error=entries[target][best_idx].error,
+            )
+            optimization_history[target].append(step)
+            if histories is not None:
+                histories[target].append(step)
+            print(f"{target}: completed iteration {step.iteration + 1}")
+
+    res = {
+        target: {
+            "x": spaces[target].from_unit(es.result.xbest),
+            "fun": es.result.fbest,
+            "nfev": es.result.evaluations,
+            "nit": es.result.iterations,
+            "success": es.result.stop,
+        }
+        for target, es in strategies.items()
+    }
+
+    return res, optimization_history
@@ -0,0 +1,87 @@
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+
+CACHE_SIZE = 1024
+
+
+@dataclass
+class CachedEvaluation:
+    infidelity: float
+    error: float
+    run_id: int
+
+
+class EvaluationCache:
+    """Bounded LRU cache of RB evaluations keyed on the parameter vector.
+
+    With ``resolution`` (one quantum per parameter) points closer than the
+    quantum share an entry, otherwise parameters are matched exactly.
+    ``on_put`` is called after every new measurement, e.g. to checkpoint.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, resolution=None, on_put=None):
+        self.maxsize = maxsize
+        self.on_put = on_put
+        self.resolution = None if resolution is None else np.asarray(resolution)
+        self.entries = OrderedDict()
+        self.runs = 0
+        # lowest infidelity measured with a finite error bar, kept across
+        # evictions; a failed fit is no incumbent to reject candidates against
+        self.best = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, params):
+        params = np.asarray(params, dtype=float)
+        if self.resolution is None:
+            return tuple(params.tolist())
+        return tuple(np.round(params / self.resolution).astype(np.int64).tolist())
+
+    def get(self, params):
+        key = self.key(params)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, params, infidelity, error, run_id=None):
+        if run_id is None:
+            run_id = self.runs
+        self.runs += 1
+        entry = CachedEvaluation(infidelity, error, run_id)
+        if np.isfinite(error) and (
+            self.best is None or infidelity < self.best.infidelity
+        ):
+            self.best = entry
+        key = self.key(params)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        if self.on_put is not None:
+            self.on_put()
+        return entry
+
+    def discard(self, params):
+        self.entries.pop(self.key(params), None)
+
+    def evaluate(self, params, measure, refresh=False):
+        # measure() returns (infidelity, error) and is only called on a miss,
+        # refresh=True forces a re-measurement of an already known point
+        if not refresh:
+            entry = self.get(params)
+            if entry is not None:
+                return entry
+        infidelity, error = measure()
+        return self.put(params, infidelity, error)
+
+    def __getstate__(self):
+        # the hook belongs to the running process, not to the cached data
+        return {**self.__dict__, "on_put": None}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+from pathlib import Path
+
+HISTORY_FILE = "optimization_history.csv"
+HISTORY_NPZ = "optimization_history.npz"
+
+
+class HistoryWriter:
+    """Append-only optimization history, flushed after every step.
+
+    Each ``OptimizationStep`` becomes one CSV line, so a crash or interrupt
+    loses at most the line being written. An existing history in the same
+    folder is overwritten, unless ``resume`` is set and new steps are appended.
+    """
+
+    def __init__(self, folder, fsync=False, resume=False):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        self.path = Path(folder) / HISTORY_FILE
+        self.fsync = fsync
+        self.file = open(self.path, "a" if resume else "w")
+        self.header = self.path.stat().st_size > 0
+
+    def append(self, step):
+        parameters = np.atleast_1d(step.parameters)
+        if not self.header:
+            columns = [f"parameters_{i}" for i in range(len(parameters))]
+            columns = ["iteration", *columns, "objective_value", "error"]
+            self.file.write(",".join(columns) + "\n")
+            self.header = True
+
+        error = step.objective_value_error
+        values = [*parameters, step.objective_value, np.nan if error is None else error]
+        self.file.write(
+            f"{step.iteration}," + ",".join(repr(float(v)) for v in values) + "\n"
+        )
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_history(folder):
+    # same keys as optimization_history.npz, which is the fallback for old runs
+    folder = Path(folder)
+    stream = folder / HISTORY_FILE
+    if not stream.exists():
+        return dict(np.load(folder / HISTORY_NPZ))
+
+    text = stream.read_text()
+    header, *lines = text.split("\n")
+    if not text.endswith("\n"):
+        # the run stopped while writing the last line
+        lines = lines[:-1]
+    rows = np.array([line.split(",") for line in lines if line], dtype=float)
+    # no step written yet leaves iteration, objective value and error columns
+    rows = rows.reshape(-1, max(len(header.split(",")), 3))
+
+    return {
+        "iterations": rows[:, 0].astype(int),
+        "parameters": rows[:, 1:-2],
+        "objective_values": rows[:, -2],
+        "objective_value_errors": rows[:, -1],
+    }
@@ -4,15 +4,18 @@ import time
 import datetime
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
-from qibocal.auto.execute import Executor
-from qibocal import update
-from qibocal.cli.report import report
-from optunaopt_utils import rb_optimization, log_optimization
+from session import open_executor
+from tracing import TRACER
+from warm_start import initial_state, INITIALIZERS
+from reporting import render_report, REPORT_MODES
+from sequence_pool import open_pool, POOL_MODES
 
 NSHOTS = 2000
+# keys of optunaopt_utils.PRUNERS, which loads qibocal and optuna on import
+PRUNER_NAMES = ("median", "halving", "hyperband")
 
 
-def parse() -> Namespace:
+def parse(argv=None) -> Namespace:
     parser = ArgumentParser(description="Fine tuning calibration using cma algorithm")
     parser.add_argument(
         "--platform", type=str, required=True, help="Platform identifier"
@@ -23,13 +26,73 @@ def parse() -> Namespace:
     parser.add_argument(
         "--platform_update", action="store_true", help="Enable platform update"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Run RB in increments until the error bar is small enough",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Ask the next trial while the hardware measures the last one",
+    )
+    parser.add_argument(
+        "--pruner",
+        type=str,
+        choices=PRUNER_NAMES,
+        help="Report RB in sequence-count stages and prune weak trials early",
+    )
+    parser.add_argument(
+        "--study",
+        type=str,
+        help="Study to create or attach to, workers with the same study share trials",
+    )
+    parser.add_argument(
+        "--storage",
+        type=str,
+        default="sqlite",
+        choices=["sqlite", "journal"],
+        help="Study storage, use journal to run several workers concurrently",
+    )
+    parser.add_argument(
+        "--n_trials", type=int, default=1000, help="Trial budget of the whole study"
+    )
+    parser.add_argument(
+        "--sequence_pool",
+        type=str,
+        choices=POOL_MODES,
+        help="Draw RB sequences from one pool per run, common gives every candidate "
+        "the same ones (executors whose rb_ondevice takes sequences, the "
+        "simulator; the qibocal one is refused)",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="full",
+        choices=REPORT_MODES,
+        help="Report of the run, summary keeps only the best and worst RB evaluations",
+    )
+    parser.add_argument(
+        "--background_report",
+        action="store_true",
+        help="Render the report while the results are saved",
+    )
+    parser.add_argument(
+        "--init",
+        type=str,
+        default="platform",
+        choices=list(INITIALIZERS),
+        help="Start from the platform values or from recent runs on the target",
+    )
+    return parser.parse_args(argv)
 
 
 def update_platform(
     args: Namespace,
     params: list[float],
 ):
+    from qibocal import update
+
     platform = args.platform
     target = args.target
     amplitude, frequency, beta = params
@@ -39,36 +102,57 @@ def update_platform(
 
 
 def execute(args: Namespace):
+    from optunaopt_utils import rb_optimization, log_optimization, make_storage
+
     platform = args.platform
     target = args.target
     platform_update = args.platform_update
+    adaptive = args.adaptive
+    pruner = args.pruner
+
+    start_time = time.time()
+    now = datetime.datetime.now()
+    formatted_time = now.strftime("%Y%m%d_%H%M%S")
 
     executor_path = (
         Path.cwd().parent / "optimization_data" / f"{target}_{formatted_time}"
     )
     study_name = f"{formatted_time}"
+    if args.study is not None:
+        # every worker of a shared study keeps its own executor data
+        study_name = args.study
+        executor_path = (
+            Path.cwd().parent
+            / "optimization_data"
+            / f"{target}_{study_name}_{formatted_time}_{os.getpid()}"
+        )
     study_path = Path.cwd().parent / "optuna_data" / f"{target}_{study_name}"
     os.makedirs(os.path.dirname(study_path), exist_ok=True)
+    # shared by the workers of a study, told apart by their pid
+    TRACER.open(f"{study_path}_trace", backend="optuna", target=target, pid=os.getpid())
 
-    start_time = time.time()
-    now = datetime.datetime.now()
-    formatted_time = now.strftime("%Y%m%d_%H%M%S")
-
-    with Executor.open(
+    with open_executor(
         "myexec",
         path=executor_path,
         platform=platform,
         targets=[target],
         update=platform_update,
         force=True,
-    ) as e:
+    ) as e, open_pool(e, args.sequence_pool, f"{study_path}_trace"):
 
         e.platform.settings.nshots = 2000
-        ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
-        freq_RX = e.platform.qubits[target].native_gates.RX.frequency
+        start = initial_state(e, target, INITIALIZERS[args.init](target), drag=False)
+        ampl_RX, freq_RX = start.x0[:2]
         # eventually add drag parameter
 
         init_guess = {"amplitude": ampl_RX, "frequency": freq_RX}
+        # the best recent evaluations are tried right after the start
+        warm_trials = []
+        if start.points is not None:
+            warm_trials = [
+                {"amplitude": amplitude, "frequency": frequency}
+                for amplitude, frequency, _ in start.points
+            ]
 
         bounds = [[-0.5, 0.5], [freq_RX - 4e6, freq_RX + 4e6]]
         # eventually add bounds for drag parameter
@@ -79,10 +163,19 @@ def execute(args: Namespace):
             init_guess,
             bounds,
             study_name=study_name,
-            storage=f"sqlite:///{study_path}.db",
+            storage=make_storage(study_path, args.storage),
+            n_trials=args.n_trials,
+            adaptive=adaptive,
+            pruner=pruner,
+            load_if_exists=args.study is not None,
+            warm_trials=warm_trials,
+            pipelined=args.pipelined,
         )
 
-    report(e.path, e.history)
+    TRACER.close()
+    render_report(
+        e.path, e.history, [target], args.report, background=args.background_report
+    )
 
     end_time = time.time()
     elapsed_time = end_time - start_time
@@ -90,8 +183,8 @@ def execute(args: Namespace):
     log_optimization(study_name, elapsed_time, "../optuna_data/time_log.txt")
 
 
-def main():
-    execute(parse())
+def main(argv=None):
+    execute(parse(argv))
 
 
 if __name__ == "__main__":
@@ -1,24 +1,44 @@
-import numpy as np
+import asyncio
 from qibocal.auto.execute import Executor
 from qibolab import pulses
 from dataclasses import dataclass
+from eval_cache import EvaluationCache
+from rb_fit import rb_infidelity
+from adaptive_rb import sequential_rb, SEQUENCES_STEP, TARGET_ERROR
+from program_cache import rb_ondevice
+from tracing import phase, evaluation, OptimizerClock
+from parameter_space import ParameterSpace
+from pipeline import RBPipeline
 import optuna
+from optuna.trial import TrialState
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
 
 DELTA = 20
 MAX_DEPTH = 1000
 AVG_GATE = 1.875  # 1.875 is the average number of gates in a clifford operation
 SEQUENCES = 1000
 INIT_STD = 0.25
+CACHE_RESOLUTION = None  # parameter quanta of the evaluation cache, None is exact
 
+# pruners compare trials on the infidelity reported after every SEQUENCES_STEP
+PRUNERS = {
+    "median": lambda: optuna.pruners.MedianPruner(n_startup_trials=5),
+    "halving": lambda: optuna.pruners.SuccessiveHalvingPruner(
+        min_resource=SEQUENCES_STEP, reduction_factor=3
+    ),
+    "hyperband": lambda: optuna.pruners.HyperbandPruner(
+        min_resource=SEQUENCES_STEP, max_resource=SEQUENCES, reduction_factor=3
+    ),
+}
 
-# objective function to minimize
-def objective(trial, e, target, bounds):
 
-    amplitude = trial.suggest_float("amplitude", bounds[0][0], bounds[0][1])
-    frequency = trial.suggest_float("frequency", bounds[1][0], bounds[1][1])
+def measure(params, e, target, incumbent=None, adaptive=False, trial=None):
+    amplitude, frequency = params
 
-    e.platform.qubits[target].native_gates.RX.amplitude = amplitude
-    e.platform.qubits[target].native_gates.RX.frequency = frequency
+    with phase("parameter_update"):
+        e.platform.qubits[target].native_gates.RX.amplitude = amplitude
+        e.platform.qubits[target].native_gates.RX.frequency = frequency
 
     # eventually add for DRAG pulse optimization
     # pulse = e.platform.qubits[target].native_gates.RX.pulse(start=0)
@@ -26,24 +46,67 @@ def objective(trial, e, target, bounds):
     # drag_pulse = pulses.Drag(rel_sigma=rel_sigma, beta=beta)
     # e.platform.qubits[target].native_gates.RX.shape = repr(drag_pulse)
 
-    rb_output = e.rb_ondevice(
-        num_of_sequences=SEQUENCES,
-        max_circuit_depth=MAX_DEPTH,
-        delta_clifford=DELTA,
-        n_avg=1,
-        save_sequences=True,
-        apply_inverse=True,
+    if trial is not None:
+        # report the running estimate to the pruner after every increment
+        def report(estimate):
+            trial.report(estimate.infidelity, step=estimate.sequences)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        return sequential_rb(
+            e,
+            target,
+            MAX_DEPTH,
+            DELTA,
+            incumbent if adaptive else None,
+            target_error=TARGET_ERROR if adaptive else 0,
+            max_sequences=SEQUENCES,
+            callback=report,
+        )
+
+    if adaptive:
+        return sequential_rb(e, target, MAX_DEPTH, DELTA, incumbent)
+
+    with phase("rb_ondevice"):
+        rb_output = rb_ondevice(
+            e,
+            num_of_sequences=SEQUENCES,
+            max_circuit_depth=MAX_DEPTH,
+            delta_clifford=DELTA,
+            n_avg=1,
+            save_sequences=True,
+            apply_inverse=True,
+        )
+
+    return rb_infidelity(rb_output, target)
+
+
+def suggest(trial, space):
+    # TPE models every parameter on its own range, so sampling the normalized
+    # coordinates would give the same trials; the study keeps physical values
+    return tuple(
+        trial.suggest_float(name, low, high)
+        for name, (low, high) in zip(space.names, space.bounds)
     )
 
-    # Calculate infidelity and error
-    stdevs = np.sqrt(np.diag(np.reshape(rb_output.results.cov[target], (3, 3))))
 
-    pars = rb_output.results.pars.get(target)
-    one_minus_p = 1 - pars[2]
-    r_c = one_minus_p * (1 - 1 / 2**1)
-    r_g = r_c / AVG_GATE
-    r_c_std = stdevs[2] * (1 - 1 / 2**1)
-    r_g_std = r_c_std / AVG_GATE
+# objective function to minimize
+def objective(trial, e, target, space, cache=None, adaptive=False, pruning=False):
+
+    params = suggest(trial, space)
+    staged_trial = trial if pruning else None
+
+    with evaluation():
+        if cache is None:
+            r_g, r_g_std = measure(params, e, target, None, adaptive, staged_trial)
+        else:
+            incumbent = None if cache.best is None else cache.best.infidelity
+            entry = cache.evaluate(
+                params,
+                lambda: measure(params, e, target, incumbent, adaptive, staged_trial),
+            )
+            r_g, r_g_std = entry.infidelity, entry.error
+            trial.set_user_attr("run_id", entry.run_id)
 
     trial.set_user_attr("error", r_g_std)
 
@@ -51,6 +114,54 @@ def objective(trial, e, target, bounds):
     return r_g
 
 
+def optimize_pipelined(study, e, target, space, cache, n_trials):
+    # ask-and-tell with the next trial asked and prepared while the hardware
+    # measures the previous one; TPE does not see the trials still running
+    pipeline = RBPipeline(
+        e,
+        target,
+        cache,
+        num_of_sequences=SEQUENCES,
+        max_circuit_depth=MAX_DEPTH,
+        delta_clifford=DELTA,
+        n_avg=1,
+        save_sequences=True,
+        apply_inverse=True,
+    )
+    states = (TrialState.COMPLETE, TrialState.PRUNED)
+    running = set()
+
+    def trials():
+        # same budget as MaxTrialsCallback, plus the trials in flight here
+        while True:
+            finished = len(study.get_trials(deepcopy=False, states=states))
+            if finished + len(running) >= n_trials:
+                return
+            with phase("optimizer"):
+                trial = study.ask()
+            running.add(trial.number)
+            yield trial
+
+    def tell(trial, entry):
+        trial.set_user_attr("run_id", entry.run_id)
+        trial.set_user_attr("error", entry.error)
+        with phase("optimizer"):
+            study.tell(trial, entry.infidelity)
+        running.discard(trial.number)
+        print("terminating pipelined objective call")
+
+    try:
+        with pipeline:
+            asyncio.run(
+                pipeline.map(trials(), lambda trial: suggest(trial, space), tell)
+            )
+    finally:
+        # on errors and interrupts the trials in flight would stay RUNNING
+        for number in running:
+            study.tell(number, state=TrialState.FAIL)
+    print(f"hardware busy {pipeline.utilization:.1%} of the optimization")
+
+
 def rb_optimization(
     executor: Executor,
     target: str,
@@ -58,24 +169,61 @@ def rb_optimization(
     bounds: list[list[float]],
     study_name: str,
     storage: str,
+    n_trials: int = 1000,
+    adaptive: bool = False,
+    pruner: str = None,
+    load_if_exists: bool = False,
+    warm_trials: list = (),
+    pipelined: bool = False,
 ):
+    if pipelined and (adaptive or pruner is not None):
+        raise ValueError("pipelined evaluation runs one fixed-size RB job per trial")
+
+    cache = EvaluationCache(resolution=CACHE_RESOLUTION)
+    pruning = pruner is not None
+    space = ParameterSpace(list(init_guess.values()), bounds)
 
     def wrapped_objective(trial):
-        return objective(trial, executor, target, bounds)
+        return objective(trial, executor, target, space, cache, adaptive, pruning)
 
     study = optuna.create_study(
         direction="minimize",
         study_name=study_name,
         storage=storage,
-        load_if_exists=False,
+        load_if_exists=load_if_exists,
+        pruner=PRUNERS[pruner]() if pruning else None,
+    )
+    # simulate initial guess (as I do in scipy optimization), once per study
+    study.enqueue_trial(init_guess, skip_if_exists=True)
+    for params in warm_trials:
+        study.enqueue_trial(params, skip_if_exists=True)
+    # n_trials is the budget of the whole study, shared by every attached worker
+    if pipelined:
+        optimize_pipelined(study, executor, target, space, cache, n_trials)
+        return study
+    states = (TrialState.COMPLETE, TrialState.PRUNED)
+    finished = len(study.get_trials(deepcopy=False, states=states))
+    max_trials = optuna.study.MaxTrialsCallback(n_trials, states=states)
+    # sampling and storage updates run between the objective calls
+    clock = OptimizerClock()
+    study.optimize(
+        clock.wrap(wrapped_objective),
+        n_trials=max(n_trials - finished, 0),
+        callbacks=[max_trials],
+        show_progress_bar=False,
     )
-    # simulate initial guess (as I do in scipy optimization)
-    study.enqueue_trial(init_guess)
-    study.optimize(wrapped_objective, n_trials=1000, show_progress_bar=False)
+    clock.stop()
 
     return study
 
 
+def make_storage(path, kind="sqlite"):
+    # a journal file can be shared by several worker processes, sqlite cannot
+    if kind == "journal":
+        return JournalStorage(JournalFileBackend(f"{path}.log"))
+    return f"sqlite:///{path}.db"
+
+
 # 1e-5 va bene come tolleranza? L'errore se non sbaglio dovrebbe essere la deviazione standard
 # e doverbbe essere attorno a 1e-4 nei report di Hisham
 
@@ -0,0 +1,44 @@
+import numpy as np
+
+# one unit of the normalized coordinates, about the uncertainty of the coarse
+# calibration of each parameter
+STEP_SCALES = {"amplitude": 1e-3, "frequency": 5e5, "beta": 0.25}
+PARAMETERS = list(STEP_SCALES)
+
+
+class ParameterSpace:
+    """Affine map between RX parameters and normalized coordinates.
+
+    ``u = (x - center) / scales``, so the start is the origin and one unit is
+    a typical step of every parameter whatever its physical unit. The spread
+    of a warm start can be passed as ``scales`` to whiten the space. The
+    first ``len(center)`` of PARAMETERS are used, in that order.
+    """
+
+    def __init__(self, center, bounds, scales=None):
+        self.center = np.asarray(center, dtype=float)
+        lower, upper = zip(*bounds)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.names = PARAMETERS[: len(self.center)]
+        if scales is None:
+            scales = [STEP_SCALES[name] for name in self.names]
+        self.scales = np.asarray(scales, dtype=float)
+
+    def to_unit(self, x):
+        return (np.asarray(x, dtype=float) - self.center) / self.scales
+
+    def from_unit(self, u):
+        return self.center + np.asarray(u, dtype=float) * self.scales
+
+    @property
+    def bounds(self):
+        return list(zip(self.lower, self.upper))
+
+    @property
+    def unit_bounds(self):
+        return list(zip(self.to_unit(self.lower), self.to_unit(self.upper)))
+
+    def unit_simplex(self):
+        # the origin and one unit step along every coordinate
+        return np.vstack([np.zeros(len(self.center)), np.eye(len(self.center))])
@@ -0,0 +1,138 @@
+import asyncio
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from qibolab import pulses
+from eval_cache import CachedEvaluation
+from program_cache import rb_acquire
+from rb_fit import rb_infidelity
+from tracing import phase
+
+DEPTH = 2  # candidates in flight, one running on the hardware and one queued
+# seconds a thread holds the GIL before yielding while the pipeline runs, the
+# worker is not kept waiting by the event loop when the instrument returns
+SWITCH_INTERVAL = 5e-4
+
+
+def rx_fields(e, target, params):
+    # the RX fields set_rx_parameters would write, computed without touching
+    # the platform the running job reads
+    amplitude, frequency, *beta = params
+    fields = {"amplitude": amplitude, "frequency": frequency}
+    if beta:
+        pulse = e.platform.qubits[target].native_gates.RX.pulse(start=0)
+        drag_pulse = pulses.Drag(rel_sigma=pulse.shape.rel_sigma, beta=beta[0])
+        fields["shape"] = repr(drag_pulse)
+    return fields
+
+
+class RBPipeline:
+    """RB evaluations of successive candidates overlapped with classical work.
+
+    The instrument runs one job at a time, so jobs are queued in order on a
+    single worker thread with up to ``depth`` candidates in flight: while one
+    runs on the hardware, the event loop fits the previous output, runs the
+    optimizer and prepares the next candidate, whose job starts as soon as the
+    running one ends. The worker writes the RX parameters of a candidate to
+    the platform right before its job. Executors that acquire and fit RB
+    separately (``acquire_rb`` and ``fit_rb``) leave the fit to the event
+    loop as well, the others fit inside the job. ``utilization`` is the share
+    of the wall time the worker spent running jobs. ``close`` (or leaving a
+    ``with`` block) stops the worker and restores the switch interval.
+    """
+
+    def __init__(self, e, target, cache, depth=DEPTH, **rb_kwargs):
+        self.e = e
+        self.target = target
+        self.cache = cache
+        self.depth = depth
+        self.rb_kwargs = rb_kwargs
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hardware")
+        self.busy = 0.0
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SWITCH_INTERVAL)
+        self.started = time.perf_counter()
+        self.stopped = None
+
+    def _run(self, fields):
+        start = time.perf_counter()
+        rx = self.e.platform.qubits[self.target].native_gates.RX
+        with phase("parameter_update"):
+            for name, value in fields.items():
+                setattr(rx, name, value)
+        with phase("rb_ondevice"):
+            data = rb_acquire(self.e, **self.rb_kwargs)
+        self.busy += time.perf_counter() - start
+        return data
+
+    def submit(self, params):
+        # cached candidates skip the hardware queue
+        loop = asyncio.get_running_loop()
+        entry = self.cache.get(params)
+        if entry is not None:
+            future = loop.create_future()
+            future.set_result(entry)
+            return future
+        with phase("prepare"):
+            fields = rx_fields(self.e, self.target, params)
+        return loop.run_in_executor(self.worker, self._run, fields)
+
+    def finish(self, params, result):
+        if isinstance(result, CachedEvaluation):
+            return result
+        with phase("fit"):
+            if hasattr(self.e, "fit_rb"):
+                result = self.e.fit_rb(result)
+            r_g, r_g_std = rb_infidelity(result, self.target)
+        return self.cache.put(params, r_g, r_g_std)
+
+    async def map(self, items, parameters=None, done=None):
+        """Cache entry of every item, measured in order.
+
+        ``items`` is only advanced when there is room in the pipeline, so a
+        generator asking an optimizer for its next point asks as late as
+        possible. ``parameters(item)`` gives the RX parameters of an item, the
+        item itself by default, and ``done(item, entry)`` is called as soon as
+        the item is measured.
+        """
+        items = iter(items)
+        window, entries = deque(), []
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(window) < self.depth:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    params = item if parameters is None else parameters(item)
+                    window.append((item, params, self.submit(params)))
+                if not window:
+                    return entries
+                item, params, job = window.popleft()
+                entry = self.finish(params, await job)
+                if done is not None:
+                    done(item, entry)
+                entries.append(entry)
+        finally:
+            # on errors and interrupts the queued jobs never reach the hardware
+            for _, _, job in window:
+                job.cancel()
+
+    @property
+    def utilization(self):
+        elapsed = (self.stopped or time.perf_counter()) - self.started
+        return self.busy / elapsed if elapsed else 0.0
+
+    def close(self):
+        self.worker.shutdown(cancel_futures=True)
+        sys.setswitchinterval(self.switch_interval)
+        self.stopped = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
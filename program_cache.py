@@ -0,0 +1,69 @@
+import weakref
+from collections import OrderedDict
+from sequence_pool import pool_arguments
+
+PROGRAM_CACHE_SIZE = 64  # compiled programs kept per executor
+
+
+class ProgramCache:
+    """LRU cache of compiled RB programs, one per executor session.
+
+    Programs are keyed on the ``rb_ondevice`` arguments and on everything the
+    executor reports through ``rb_program_key`` (targets, pulse envelopes),
+    but not on the RX amplitude, frequency and DRAG beta: the executor
+    patches those into the program right before running it. The Clifford
+    sequences are not compiled in either, every run takes its own (see
+    ``rb_ondevice``), so calls with the same arguments still measure fresh
+    sequences.
+    """
+
+    def __init__(self, maxsize=PROGRAM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.programs = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def program(self, e, **kwargs):
+        programs = self.programs.setdefault(e, OrderedDict())
+        key = (e.rb_program_key(), tuple(sorted(kwargs.items())))
+        program = programs.get(key)
+        if program is None:
+            self.misses += 1
+            program = e.compile_rb(**kwargs)
+            programs[key] = program
+            while len(programs) > self.maxsize:
+                programs.popitem(last=False)
+        else:
+            self.hits += 1
+        programs.move_to_end(key)
+        return program
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return sum(len(programs) for programs in self.programs.values())
+
+
+PROGRAMS = ProgramCache()
+
+
+def rb_ondevice(e, **kwargs):
+    # executors that can compile once and patch the RX parameters reuse the
+    # programs in PROGRAMS, the others rebuild the program on every call
+    kwargs = pool_arguments(e, kwargs)
+    if not hasattr(e, "compile_rb"):
+        return e.rb_ondevice(**kwargs)
+    sequences = kwargs.pop("sequences", None)
+    return e.execute_rb(PROGRAMS.program(e, **kwargs), sequences)
+
+
+def rb_acquire(e, **kwargs):
+    # rb_ondevice without the fit, for executors that run it apart with fit_rb
+    if not hasattr(e, "acquire_rb"):
+        return rb_ondevice(e, **kwargs)
+    kwargs = pool_arguments(e, kwargs)
+    sequences = kwargs.pop("sequences", None)
+    return e.acquire_rb(PROGRAMS.program(e, **kwargs), sequences)
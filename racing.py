@@ -0,0 +1,131 @@
+import numpy as np
+from dataclasses import dataclass
+from adaptive_rb import SequentialEstimate, REJECT_SIGMAS, MAX_SEQUENCES
+from cma_utils import measure_batch, set_rx_parameters, MAX_DEPTH, DELTA
+from rb_fit import rb_infidelity
+from program_cache import rb_ondevice
+from tracing import phase, evaluation
+
+RACE_CANDIDATES = 8  # best distinct points of the history entering the race
+RACE_SEQUENCES = 50  # sequences per candidate in the first round
+RACE_GROWTH = 2  # the per-candidate budget grows by this factor every round
+
+
+@dataclass
+class RaceResult:
+    parameters: np.ndarray
+    infidelity: float
+    error: float
+    sequences: int  # spent by the whole race
+    rounds: int
+
+
+def top_candidates(optimization_history, k=RACE_CANDIDATES):
+    # lowest single-shot objective first, repeated points only once
+    steps = sorted(optimization_history, key=lambda step: step.objective_value)
+    candidates = []
+    for step in steps:
+        parameters = np.asarray(step.parameters, dtype=float)
+        if not any(np.array_equal(parameters, c) for c in candidates):
+            candidates.append(parameters)
+        if len(candidates) == k:
+            break
+    return candidates
+
+
+def measure_round(e, target, candidates, sequences):
+    if hasattr(e, "rb_ondevice_batch"):
+        # one hardware job for the whole round
+        return measure_batch(candidates, e, target, sequences=sequences)
+
+    results = []
+    for params in candidates:
+        set_rx_parameters(e, target, params)
+        with phase("rb_ondevice"):
+            rb_output = rb_ondevice(
+                e,
+                num_of_sequences=sequences,
+                max_circuit_depth=MAX_DEPTH,
+                delta_clifford=DELTA,
+                n_avg=1,
+                save_sequences=True,
+                apply_inverse=True,
+            )
+        results.append(rb_infidelity(rb_output, target))
+    return results
+
+
+def ranking(estimate):
+    # candidates whose fits all failed go last
+    return (not np.isfinite(estimate.error), estimate.infidelity)
+
+
+def race(e, target, candidates, sequences=RACE_SEQUENCES, max_sequences=MAX_SEQUENCES):
+    """Re-measure ``candidates`` until one is statistically the best.
+
+    Every round measures the surviving candidates with a growing number of
+    sequences and pools the results. Candidates whose lower bound is above the
+    best upper bound are dropped, and at most half of them survive a round
+    (successive halving), so the total cost stays a few times the first round.
+    """
+    estimates = [SequentialEstimate() for _ in candidates]
+    active = list(range(len(candidates)))
+    spent, rounds = 0, 0
+
+    while len(active) > 1 and estimates[active[0]].sequences < max_sequences:
+        with evaluation():
+            results = measure_round(
+                e, target, [candidates[i] for i in active], sequences
+            )
+        for i, (r_g, r_g_std) in zip(active, results):
+            estimates[i].add(r_g, r_g_std, sequences)
+        spent += sequences * len(active)
+        rounds += 1
+
+        best_upper = min(
+            estimates[i].infidelity + REJECT_SIGMAS * estimates[i].error for i in active
+        )
+        active = [
+            i
+            for i in active
+            if estimates[i].infidelity - REJECT_SIGMAS * estimates[i].error
+            <= best_upper
+        ]
+        active = sorted(active, key=lambda i: ranking(estimates[i]))
+        active = active[: max(1, int(np.ceil(len(active) / 2)))]
+        print(f"race round {rounds}: {len(active)} candidates left")
+        sequences = min(
+            sequences * RACE_GROWTH, max_sequences - estimates[active[0]].sequences
+        )
+
+    winner = active[0]
+    return RaceResult(
+        parameters=candidates[winner],
+        infidelity=estimates[winner].infidelity,
+        error=estimates[winner].error,
+        sequences=spent,
+        rounds=rounds,
+    )
+
+
+def race_history(e, target, optimization_history, k=RACE_CANDIDATES):
+    candidates = top_candidates(optimization_history, k)
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        # nothing to race, the one point keeps the values it was measured with
+        best = min(optimization_history, key=lambda step: step.objective_value)
+        error = best.objective_value_error
+        return RaceResult(
+            parameters=candidates[0],
+            infidelity=best.objective_value,
+            error=np.inf if error is None else error,
+            sequences=0,
+            rounds=0,
+        )
+    return race(e, target, candidates)
+
+
+def committable(result):
+    # a race whose winner has no finite error bar is not written to the platform
+    return result is not None and bool(np.isfinite(result.error))
@@ -0,0 +1,125 @@
+import numpy as np
+
+AVG_GATE = 1.875  # 1.875 is the average number of gates in a Clifford operation
+CHUNK_SIZE = 4096  # candidates fitted at once, bounds the memory of large inputs
+ITERATIONS = 30  # Levenberg-Marquardt steps after the grid initialization
+# decay parameters scanned for the initial guess, from 1 - 1e-5 down to ~0.02
+P_GRID = 1 - np.logspace(-5, -0.01, 300)
+
+
+def decay(depths, pars):
+    # A * p^m + B for every row of pars = [A, B, p]
+    a, b, p = (pars[:, i, None] for i in range(3))
+    return a * p**depths + b
+
+
+def _grid_guess(depths, survival):
+    # for fixed p the model is linear in A and B, so every grid point has a
+    # closed-form least squares solution; it is clipped to the [0, 1] bounds
+    # before comparing residuals, otherwise fast decays pick a p whose
+    # unbounded A the fit cannot reach and stop in a worse minimum
+    x = P_GRID[:, None] ** depths
+    x_mean = x.mean(axis=1)
+    x_centered = x - x_mean[:, None]
+    x_var = np.maximum((x_centered**2).sum(axis=1), np.finfo(float).tiny)
+    y_mean = survival.mean(axis=1, keepdims=True)
+    y_centered = survival - y_mean
+
+    covariance = y_centered @ x_centered.T
+    a = np.clip(covariance / x_var, 0, 1)
+    b = np.clip(y_mean - a * x_mean, 0, 1)
+    offset = y_mean - a * x_mean - b
+    sse = (
+        (y_centered**2).sum(axis=1, keepdims=True)
+        - 2 * a * covariance
+        + a**2 * x_var
+        + len(depths) * offset**2
+    )
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(len(survival))
+    return np.stack([a[rows, best], b[rows, best], P_GRID[best]], axis=1)
+
+
+def _jacobian(depths, pars):
+    a, p = pars[:, 0, None], pars[:, 2, None]
+    power = p**depths
+    return np.stack(
+        [power, np.ones_like(power), a * depths * p ** (depths - 1)], axis=2
+    )
+
+
+def _fit_chunk(depths, survival):
+    # same bounds as the reference fit, A, B and p all in [0, 1]
+    pars = np.clip(_grid_guess(depths, survival), 0, 1)
+    sse = ((survival - decay(depths, pars)) ** 2).sum(axis=1)
+    damping = np.full(len(survival), 1e-3)
+
+    for _ in range(ITERATIONS):
+        jac = _jacobian(depths, pars)
+        residuals = survival - decay(depths, pars)
+        jtj = np.einsum("nmi,nmj->nij", jac, jac)
+        jtr = np.einsum("nmi,nm->ni", jac, residuals)
+
+        diagonal = np.einsum("nii->ni", jtj)
+        damped = jtj + (damping[:, None] * diagonal + 1e-300)[:, :, None] * np.eye(3)
+        step = np.linalg.solve(damped, jtr[:, :, None])[:, :, 0]
+
+        trial = np.clip(pars + step, 0, 1)
+        trial_sse = ((survival - decay(depths, trial)) ** 2).sum(axis=1)
+
+        accept = trial_sse < sse
+        pars[accept] = trial[accept]
+        sse[accept] = trial_sse[accept]
+        damping = np.where(accept, damping / 10, damping * 10)
+
+    # same convention as scipy curve_fit with absolute_sigma=False
+    jac = _jacobian(depths, pars)
+    jtj = np.einsum("nmi,nmj->nij", jac, jac)
+    dof = max(len(depths) - 3, 1)
+    cov = np.linalg.pinv(jtj) * (sse / dof)[:, None, None]
+    singular = np.linalg.cond(jtj) > 1 / np.finfo(float).eps
+    cov[singular] = np.inf
+    return pars, cov
+
+
+def fit_decay(depths, survival, chunk_size=CHUNK_SIZE):
+    """Fit A * p^m + B to every row of ``survival``.
+
+    ``survival`` has shape (candidates, depths) and can be a path to a ``.npy``
+    file, which is memory-mapped and fitted chunk by chunk. Returns ``pars``
+    with rows [A, B, p] and the matching (3, 3) covariances.
+    """
+    if not isinstance(survival, np.ndarray):
+        survival = np.load(survival, mmap_mode="r")
+    depths = np.asarray(depths, dtype=float)
+
+    pars = np.empty((len(survival), 3))
+    cov = np.empty((len(survival), 3, 3))
+    for start in range(0, len(survival), chunk_size):
+        chunk = np.asarray(survival[start : start + chunk_size], dtype=float)
+        pars[start : start + chunk_size], cov[start : start + chunk_size] = _fit_chunk(
+            depths, chunk
+        )
+    return pars, cov
+
+
+def infidelity(pars, cov):
+    # Calculate infidelity and error
+    one_minus_p = 1 - pars[..., 2]
+    r_c = one_minus_p * (1 - 1 / 2**1)
+    r_g = r_c / AVG_GATE
+    r_c_std = np.sqrt(cov[..., 2, 2]) * (1 - 1 / 2**1)
+    r_g_std = r_c_std / AVG_GATE
+    return r_g, r_g_std
+
+
+def rb_infidelity(rb_output, target):
+    # infidelity of the fit qibocal ran on a single rb_ondevice call
+    pars = np.asarray(rb_output.results.pars.get(target))
+    cov = np.reshape(rb_output.results.cov[target], (3, 3))
+    r_g, r_g_std = infidelity(pars, cov)
+    return float(r_g), float(r_g_std)
+
+
+def fit_infidelity(depths, survival, chunk_size=CHUNK_SIZE):
+    return infidelity(*fit_decay(depths, survival, chunk_size))
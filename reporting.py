@@ -0,0 +1,83 @@
+import copy
+import threading
+from argparse import ArgumentParser
+from pathlib import Path
+from rb_fit import rb_infidelity
+
+REPORT_MODES = ("full", "summary", "none")
+REPORT_EXTREMES = 5  # best and worst RB evaluations kept in a summary, per target
+RB_PROTOCOL = "rb_ondevice"
+
+
+def _protocol(task_id):
+    # TaskId(id, iteration) in recent qibocal, (id, iteration) tuples before
+    return getattr(task_id, "id", None) or task_id[0]
+
+
+def summary_history(history, targets, extremes=REPORT_EXTREMES):
+    """Copy of ``history`` with every calibration protocol but only the
+    ``extremes`` best and worst RB evaluations of each target."""
+    rb_tasks = [
+        (task_id, completed)
+        for task_id, completed in history.items()
+        if _protocol(task_id) == RB_PROTOCOL
+    ]
+
+    keep = set()
+    for target in targets:
+        ranked = sorted(
+            (rb_infidelity(completed, target)[0], i)
+            for i, (_, completed) in enumerate(rb_tasks)
+            if completed.results.pars.get(target) is not None
+        )
+        for _, i in ranked[:extremes] + ranked[-extremes:]:
+            keep.add(rb_tasks[i][0])
+
+    summary = copy.copy(history)
+    for task_id, _ in rb_tasks:
+        if task_id not in keep:
+            del summary[task_id]
+    return summary
+
+
+def render_report(
+    path, history, targets, mode="full", extremes=REPORT_EXTREMES, background=False
+):
+    """Render the qibocal report of an executor session.
+
+    ``summary`` only plots what is looked at after a long run, ``none`` skips
+    the report (it can be rendered later from the saved data with this
+    module). With ``background`` the report is rendered in a worker thread
+    and the run can save its results in the meantime; the thread is not a
+    daemon, the interpreter waits for it before exiting.
+    """
+    from qibocal.cli.report import report
+
+    if mode == "none":
+        return None
+    if mode == "summary":
+        history = summary_history(history, targets, extremes)
+    if not background:
+        report(path, history)
+        return None
+    worker = threading.Thread(target=report, args=(path, history), name="report")
+    worker.start()
+    return worker
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Render the report of a saved executor run")
+    parser.add_argument("path", type=Path, help="Executor output folder")
+    parser.add_argument("--targets", nargs="+", required=True, help="Qubits to rank")
+    parser.add_argument("--mode", type=str, default="summary", choices=REPORT_MODES)
+    parser.add_argument("--extremes", type=int, default=REPORT_EXTREMES)
+    args = parser.parse_args(argv)
+    from qibocal.auto.history import History
+
+    render_report(
+        args.path, History.load(args.path), args.targets, args.mode, args.extremes
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import pickle
+import numpy as np
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from history import load_history, HISTORY_FILE, HISTORY_NPZ
+from parameter_space import PARAMETERS
+
+RESULTS_DIR = "results_dataset"
+RESULT_FILE = "optimization_result.pkl"
+PARTITIONS = ["backend", "run"]
+
+
+def schema():
+    # one row per evaluation, partitioned by backend and run
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("backend", pa.string()),
+            ("run", pa.string()),
+            ("iteration", pa.int64()),
+            ("amplitude", pa.float64()),
+            ("frequency", pa.float64()),
+            ("beta", pa.float64()),
+            ("objective_value", pa.float64()),
+            ("objective_value_error", pa.float64()),
+            ("state", pa.string()),
+            ("elapsed_time", pa.float64()),
+        ]
+    )
+
+
+def write_run(columns, root=RESULTS_DIR):
+    # replaces the partition of a run that was converted before
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pydict(columns, schema=schema())
+    pq.write_to_dataset(
+        table,
+        root,
+        partition_cols=PARTITIONS,
+        existing_data_behavior="delete_matching",
+    )
+    return table.num_rows
+
+
+def history_backend(folder):
+    # runs are named {target}_cma_* and {target}_bayesopt*, scipy runs after
+    # their method
+    name = Path(folder).name
+    for backend in ("cma", "bayesopt"):
+        if f"_{backend}" in name:
+            return backend
+    return "scipy"
+
+
+def convert_history(folder, backend=None, root=RESULTS_DIR):
+    folder = Path(folder)
+    data = load_history(folder)
+    parameters = data["parameters"]
+    n = len(parameters)
+
+    elapsed_time = np.nan
+    if (folder / RESULT_FILE).exists():
+        with open(folder / RESULT_FILE, "rb") as f:
+            elapsed_time = pickle.load(f)["elapsed_time"]
+
+    columns = {
+        "backend": [backend or history_backend(folder)] * n,
+        "run": [folder.name] * n,
+        "iteration": data["iterations"],
+        "objective_value": data["objective_values"],
+        "objective_value_error": data["objective_value_errors"],
+        "state": ["COMPLETE"] * n,
+        "elapsed_time": np.full(n, elapsed_time),
+    }
+    for i, name in enumerate(PARAMETERS):
+        # runs without beta optimization leave the column empty
+        columns[name] = parameters[:, i] if parameters.shape[1] > i else [None] * n
+    return write_run(columns, root)
+
+
+def study_storage(path):
+    import optuna
+
+    if Path(path).suffix == ".db":
+        return f"sqlite:///{Path(path).absolute()}"
+    return optuna.storages.JournalStorage(
+        optuna.storages.journal.JournalFileBackend(str(path))
+    )
+
+
+def convert_study(path, root=RESULTS_DIR):
+    import optuna
+
+    storage = study_storage(path)
+    rows = 0
+    for summary in optuna.get_all_study_summaries(storage, include_best_trial=False):
+        study = optuna.load_study(study_name=summary.study_name, storage=storage)
+        trials = [
+            trial
+            for trial in study.get_trials(deepcopy=False)
+            if trial.state.is_finished()
+        ]
+        if not trials:
+            continue
+
+        n = len(trials)
+        columns = {
+            "backend": ["optuna"] * n,
+            "run": [summary.study_name] * n,
+            "iteration": [trial.number for trial in trials],
+            "objective_value": [trial.value for trial in trials],
+            "objective_value_error": [
+                trial.user_attrs.get("error") for trial in trials
+            ],
+            "state": [trial.state.name for trial in trials],
+            "elapsed_time": [
+                (
+                    trials[-1].datetime_complete - trials[0].datetime_start
+                ).total_seconds()
+            ]
+            * n,
+        }
+        for name in PARAMETERS:
+            columns[name] = [trial.params.get(name) for trial in trials]
+        rows += write_run(columns, root)
+    return rows
+
+
+def read_results(columns=None, filters=None, root=RESULTS_DIR):
+    """Read evaluations of all converted runs into a DataFrame.
+
+    Only ``columns`` are read, and ``filters`` (pyarrow DNF, e.g.
+    ``[("backend", "=", "cma"), ("objective_value", "<", 1e-3)]``) prune
+    partitions and row groups before anything is loaded.
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(root, columns=columns, filters=filters).to_pandas()
+
+
+def parse(argv=None) -> Namespace:
+    parser = ArgumentParser(
+        description="Convert optimization histories and Optuna studies to Parquet"
+    )
+    parser.add_argument(
+        "--analysis_dir",
+        type=str,
+        default="opt_analysis",
+        help="Folder with one subfolder per scipy or cma run",
+    )
+    parser.add_argument(
+        "--optuna_dir",
+        type=str,
+        default="../optuna_data",
+        help="Folder with the Optuna .db and journal storages",
+    )
+    parser.add_argument(
+        "--output", type=str, default=RESULTS_DIR, help="Root of the dataset"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse(argv)
+
+    for folder in sorted(Path(args.analysis_dir).glob("*")):
+        if (folder / HISTORY_FILE).exists() or (folder / HISTORY_NPZ).exists():
+            print(f"{folder.name}: {convert_history(folder, root=args.output)} rows")
+
+    optuna_dir = Path(args.optuna_dir)
+    for path in sorted([*optuna_dir.glob("*.db"), *optuna_dir.glob("*.log")]):
+        print(f"{path.name}: {convert_study(path, root=args.output)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,18 @@ import time
 import pickle
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
-from qibocal.auto.execute import Executor
-from qibocal import update
-from qibocal.cli.report import report
-from scipyopt_utils import rb_optimization
-from scipy.optimize import Bounds
-
+from session import open_executor, keep_rx
+from history import HistoryWriter
+from checkpoint import Checkpoint, load_checkpoint
+from tracing import TRACER
+from warm_start import initial_state, INITIALIZERS
+from reporting import render_report, REPORT_MODES
+from sequence_pool import open_pool, POOL_MODES
 
 NSHOTS = 2000
 
 
-def parse() -> Namespace:
+def parse(argv=None) -> Namespace:
     parser = ArgumentParser(description="Fine tuning calibration using cma algorithm")
     parser.add_argument(
         "--platform", type=str, required=True, help="Platform identifier"
@@ -26,26 +27,66 @@ def parse() -> Namespace:
         "--platform_update", action="store_true", help="Enable platform update"
     )
     parser.add_argument("--method", type=str, required=True, help="Optimization method")
-    return parser.parse_args()
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Run RB in increments until the error bar is small enough",
+    )
+    parser.add_argument(
+        "--resume",
+        type=str,
+        help="Run folder in opt_analysis to continue from its checkpoint",
+    )
+    parser.add_argument(
+        "--sequence_pool",
+        type=str,
+        choices=POOL_MODES,
+        help="Draw RB sequences from one pool per run, common gives every candidate "
+        "the same ones (executors whose rb_ondevice takes sequences, the "
+        "simulator; the qibocal one is refused)",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="full",
+        choices=REPORT_MODES,
+        help="Report of the run, summary keeps only the best and worst RB evaluations",
+    )
+    parser.add_argument(
+        "--background_report",
+        action="store_true",
+        help="Render the report while the results are saved",
+    )
+    parser.add_argument(
+        "--init",
+        type=str,
+        default="platform",
+        choices=list(INITIALIZERS),
+        help="Start from the platform values or from recent runs on the target",
+    )
+    return parser.parse_args(argv)
 
 
-def update_platform(
-    args: Namespace,
-    params: list[float],
-):
-    platform = args.platform
-    target = args.target
+def update_platform(e, target: str, params: list[float]):
+    # commits to the platform of the open session, which saves it on close
+    from qibocal import update
+
     amplitude, frequency, beta = params
-    update.drive_amplitude(amplitude, platform, target)
-    update.drive_frequency(frequency, platform, target)
-    update.drag_pulse_beta(beta, platform, target)
+    update.drive_amplitude(amplitude, e.platform, target)
+    update.drive_frequency(frequency, e.platform, target)
+    update.drag_pulse_beta(beta, e.platform, target)
+    keep_rx(e, target)
 
 
 def execute(args: Namespace):
+    from scipy.optimize import Bounds
+    from scipyopt_utils import rb_optimization
+    from racing import race_history, committable
 
     platform = args.platform
     target = args.target
     platform_update = args.platform_update
+    adaptive = args.adaptive
     method = args.method
 
     executor_path = (
@@ -55,40 +96,71 @@ def execute(args: Namespace):
         Path.cwd().parent / "opt_analysis" / f"{target}_{method}_post_ft_true"
     )
 
+    resume = None
+    if args.resume is not None:
+        # keep the data of the interrupted run, write the new session next to it
+        executor_path = (
+            Path.cwd().parent / "optimization_data" / f"{args.resume}_resumed"
+        )
+        opt_history_path = Path.cwd().parent / "opt_analysis" / args.resume
+        resume = load_checkpoint(opt_history_path)
+    # indexed before this run overwrites its own history
+    evaluations = INITIALIZERS[args.init](target) if resume is None else None
+
     start_time = time.time()
+    history = HistoryWriter(opt_history_path, resume=resume is not None)
+    checkpoint = Checkpoint(opt_history_path)
+    TRACER.open(opt_history_path, backend=method, target=target)
 
-    with Executor.open(
+    with open_executor(
         "myexec",
         path=executor_path,
         platform=platform,
         targets=[target],
         update=platform_update,
         force=True,
-    ) as e:
+    ) as e, open_pool(e, args.sequence_pool, opt_history_path):
 
-        # check for missing init_symplex
         e.platform.settings.nshots = NSHOTS
-        drag_output = e.drag_tuning(beta_start=-4, beta_end=4, beta_step=0.5)
-
-        beta_best = drag_output.results.betas[target]
-        ampl_RX = e.platform.qubits[target].native_gates.RX.amplitude
-        freq_RX = e.platform.qubits[target].native_gates.RX.frequency
-
-        init_guess = np.array([ampl_RX, freq_RX, beta_best])
-
-        lower_bounds = np.array([-0.5, freq_RX - 4e6, beta_best - 0.25])
-        upper_bounds = np.array([0.5, freq_RX + 4e6, beta_best + 0.25])
-        bounds = Bounds(lower_bounds, upper_bounds)
+        if resume is None:
+            start = initial_state(e, target, evaluations)
+            init_guess = start.x0
+            _, freq_RX, beta_best = init_guess
+            # a cold start has no simplex, scipy builds its default one around
+            # init_guess
+            init_simplex = start.simplex()
+
+            lower_bounds = np.array([-0.5, freq_RX - 4e6, beta_best - 0.25])
+            upper_bounds = np.array([0.5, freq_RX + 4e6, beta_best + 0.25])
+            bounds = Bounds(lower_bounds, upper_bounds)
+        else:
+            method = resume["method"]
+            init_guess = resume["init_guess"]
+            init_simplex = resume["initial_simplex"]
+            bounds = resume["bounds"]
 
         opt_results, optimization_history = rb_optimization(
             e,
             target,
             method,
             init_guess,
+            init_simplex,
             bounds,
+            adaptive=adaptive,
+            history=history,
+            checkpoint=checkpoint,
+            resume=resume,
         )
-
-    report(e.path, e.history)
+        # re-measure the best candidates before committing one of them
+        opt_results["race"] = race_history(e, target, optimization_history)
+        if platform_update and committable(opt_results["race"]):
+            update_platform(e, target, opt_results["race"].parameters)
+
+    history.close()
+    TRACER.close()
+    render_report(
+        e.path, e.history, [target], args.report, background=args.background_report
+    )
     end_time = time.time()
     elapsed_time = end_time - start_time
 
@@ -114,23 +186,9 @@ def execute(args: Namespace):
     with open(os.path.join(opt_history_path, "optimization_result.pkl"), "wb") as f:
         pickle.dump(data_stored, f)
 
-    # Update platform to best parameters result
-    fidelities = 1 - objective_values
-    sorted_indices_desc = np.argsort(fidelities)[::-1]
-
-    sorted_fidelities = fidelities[sorted_indices_desc]
-    sorted_errors = objective_value_error[sorted_indices_desc]
-    sorted_parameters = parameters[sorted_indices_desc]
-
-    try:
-        idx = np.flatnonzero(sorted_fidelities + sorted_errors > 1)[0]
-        update_platform(Namespace, sorted_parameters[idx])
-    except IndexError:
-        pass
-
 
-def main():
-    execute(parse())
+def main(argv=None):
+    execute(parse(argv))
 
 
 if __name__ == "__main__":
@@ -1,14 +1,21 @@
 import numpy as np
-from scipy.optimize import minimize
+from scipy.optimize import minimize, Bounds
 from qibocal.auto.execute import Executor
 from qibolab import pulses
 from dataclasses import dataclass
+from eval_cache import EvaluationCache
+from rb_fit import rb_infidelity
+from adaptive_rb import sequential_rb
+from program_cache import rb_ondevice
+from tracing import phase, evaluation, OptimizerClock
+from parameter_space import ParameterSpace
 
 DELTA = 10
 MAX_DEPTH = 1000
 AVG_GATE = 1.875  # 1.875 is the average number of gates in a clifford operation
 SEQUENCES = 1000
 INIT_STD = 0.25
+CACHE_RESOLUTION = None  # parameter quanta of the evaluation cache, None is exact
 
 error_storage = {"error": None}
 
@@ -21,38 +28,50 @@ class OptimizationStep:
     objective_value_error: float
 
 
-# objective function to minimize
-def objective(params, e, target):
-
-    amplitude, frequency = params
-
-    e.platform.qubits[target].native_gates.RX.amplitude = amplitude
-    e.platform.qubits[target].native_gates.RX.frequency = frequency
-
-    # needed to optimize also beta parameter for DRAG pulse
-    # pulse = e.platform.qubits[target].native_gates.RX.pulse(start=0)
-    # rel_sigma = pulse.shape.rel_sigma
-    # drag_pulse = pulses.Drag(rel_sigma=rel_sigma, beta=beta)
-    # e.platform.qubits[target].native_gates.RX.shape = repr(drag_pulse)
-
-    rb_output = e.rb_ondevice(
-        num_of_sequences=SEQUENCES,
-        max_circuit_depth=MAX_DEPTH,
-        delta_clifford=DELTA,
-        n_avg=1,
-        save_sequences=True,
-        apply_inverse=True,
-    )
+def measure(params, e, target, incumbent=None, adaptive=False):
+
+    amplitude, frequency, *beta = params
+
+    with phase("parameter_update"):
+        e.platform.qubits[target].native_gates.RX.amplitude = amplitude
+        e.platform.qubits[target].native_gates.RX.frequency = frequency
 
-    # Calculate infidelity and error
-    stdevs = np.sqrt(np.diag(np.reshape(rb_output.results.cov[target], (3, 3))))
+    # beta parameter for DRAG pulse, when optimized
+    if beta:
+        with phase("shape_rebuild"):
+            pulse = e.platform.qubits[target].native_gates.RX.pulse(start=0)
+            rel_sigma = pulse.shape.rel_sigma
+            drag_pulse = pulses.Drag(rel_sigma=rel_sigma, beta=beta[0])
+            e.platform.qubits[target].native_gates.RX.shape = repr(drag_pulse)
+
+    if adaptive:
+        return sequential_rb(e, target, MAX_DEPTH, DELTA, incumbent)
+
+    with phase("rb_ondevice"):
+        rb_output = rb_ondevice(
+            e,
+            num_of_sequences=SEQUENCES,
+            max_circuit_depth=MAX_DEPTH,
+            delta_clifford=DELTA,
+            n_avg=1,
+            save_sequences=True,
+            apply_inverse=True,
+        )
 
-    pars = rb_output.results.pars.get(target)
-    one_minus_p = 1 - pars[2]
-    r_c = one_minus_p * (1 - 1 / 2**1)
-    r_g = r_c / AVG_GATE
-    r_c_std = stdevs[2] * (1 - 1 / 2**1)
-    r_g_std = r_c_std / AVG_GATE
+    return rb_infidelity(rb_output, target)
+
+
+# objective function to minimize
+def objective(params, e, target, cache=None, adaptive=False):
+    with evaluation():
+        if cache is None:
+            r_g, r_g_std = measure(params, e, target, adaptive=adaptive)
+        else:
+            incumbent = None if cache.best is None else cache.best.infidelity
+            entry = cache.evaluate(
+                params, lambda: measure(params, e, target, incumbent, adaptive)
+            )
+            r_g, r_g_std = entry.infidelity, entry.error
 
     error_storage["error"] = r_g_std
 
@@ -67,16 +86,56 @@ def rb_optimization(
     init_guess: list[float],
     initial_simplex: list[list[float]],
     bounds,
+    adaptive: bool = False,
+    history=None,
+    checkpoint=None,
+    resume=None,
 ):
 
     optimization_history = []
     iteration_count = 0
+    cache = EvaluationCache(resolution=CACHE_RESOLUTION)
+    replayed = 0
+    if resume is not None:
+        # Nelder-Mead is deterministic given the function values, so restarting
+        # from the same initial simplex replays the interrupted run from the
+        # cache without hardware and then carries on where it stopped
+        optimization_history = resume["optimization_history"]
+        replayed = len(optimization_history)
+        cache = resume["cache"]
+    if checkpoint is not None:
+        cache.on_put = checkpoint.save
+        checkpoint.update(
+            backend="scipy",
+            method=method,
+            init_guess=np.asarray(init_guess),
+            initial_simplex=initial_simplex,
+            bounds=bounds,
+            cache=cache,
+            optimization_history=optimization_history,
+        )
+        checkpoint.save()
+
+    # the optimizer works on normalized coordinates, so tol and the simplex
+    # steps mean the same on every parameter
+    space = ParameterSpace(init_guess, zip(bounds.lb, bounds.ub))
+    unit_simplex = space.unit_simplex()
+    if initial_simplex is not None:
+        unit_simplex = space.to_unit(initial_simplex)
+
+    def unit_objective(u, *args):
+        return objective(space.from_unit(u), *args)
 
-    def callback(x, f=None):
+    def callback(u, f=None):
         nonlocal iteration_count
+        x = space.from_unit(u)
+        if iteration_count < replayed:
+            # iteration recorded before the interruption
+            iteration_count += 1
+            return
         if f is None:
-            # If the optimization method doesn't provide f, need to calculate it
-            f = objective(x, executor, target)
+            # If the optimization method doesn't provide f, look it up in the cache
+            f = objective(x, executor, target, cache, adaptive)
 
         step = OptimizationStep(
             iteration=iteration_count,
@@ -85,19 +144,27 @@ def rb_optimization(
             objective_value_error=error_storage["error"],
         )
         optimization_history.append(step)
+        if history is not None:
+            history.append(step)
         iteration_count += 1
+        if checkpoint is not None:
+            checkpoint.save()
         print(f"Completed iteration {iteration_count}, objective value: {f}")
 
+    # the simplex updates run between the objective and callback calls
+    clock = OptimizerClock()
     res = minimize(
-        objective,
-        init_guess,
-        args=(executor, target),
+        clock.wrap(unit_objective),
+        np.zeros(len(space.center)),
+        args=(executor, target, cache, adaptive),
         method=method,
         tol=1e-4,
-        options={"maxiter": 40, "initial_simplex": initial_simplex},
-        bounds=bounds,
-        callback=callback,
+        options={"maxiter": 40, "initial_simplex": unit_simplex},
+        bounds=Bounds(*zip(*space.unit_bounds)),
+        callback=clock.wrap(callback),
     )
+    clock.stop()
+    res.x = space.from_unit(res.x)
 
     return res, optimization_history
 
@@ -1,15 +1,96 @@
 import numpy as np
 import argparse
 import datetime
-from qibocal.auto.execute import Executor
-from qibocal.cli.report import report
+from dataclasses import dataclass
+from session import open_executor, keep_rx
 from pathlib import Path
+from program_cache import rb_ondevice
+from rb_fit import rb_infidelity
 
-AVG_GATE = 1.875
 # ramsey, flipping, drag, randomized benchmarking
+FLIPPING_START = 20  # nflips_max of the first round
+FLIPPING_MAX = 320  # longest flipping sequence, decoherence takes over beyond
+FLIPPING_POINTS = 20  # flip counts per round, nflips_step grows with nflips_max
+DELTA_AMPLITUDE = 3e-4  # detuning of the first round, halved with the flips
+CHI2_MAX = 2
+RB_MODES = ("end", "round", "none")  # when to check the gate with RB
+
+
+@dataclass
+class FlippingRound:
+    nflips_max: int
+    amplitude: float
+    error: float
+    correction: float
+    chi2: float
+
+
+def refine_amplitude(
+    e, target, start=FLIPPING_START, max_flips=FLIPPING_MAX, after_round=None
+):
+    """Flipping rounds that double ``nflips_max`` while the fit stays good.
+
+    Each round amplifies the residual rotation error twice as much as the one
+    before and updates the platform. The loop stops when the correction is
+    within the uncertainty of the amplitude it corrects, when the fit of the
+    longer sequences fails (the last good amplitude is kept) or at
+    ``max_flips``. ``after_round`` is called with every accepted round.
+    """
+    rounds = []
+    nflips_max = start
+    delta_amplitude = DELTA_AMPLITUDE
+    while nflips_max <= max_flips:
+        current = e.platform.qubits[target].native_gates.RX.amplitude
+        flipping_output = e.flipping(
+            nflips_max=nflips_max,
+            delta_amplitude=delta_amplitude,
+            nflips_step=max(nflips_max // FLIPPING_POINTS, 1),
+        )
+        chi2 = flipping_output.results.chi2[target][0]
+        if chi2 > CHI2_MAX:
+            if not rounds:
+                raise RuntimeError(
+                    f"Flipping fit has chi2 {chi2} greater than {CHI2_MAX}. Stopping."
+                )
+            print(f"flipping fit with {nflips_max} flips has chi2 {chi2}, stopping")
+            break
+
+        flipping_output.update_platform(e.platform)
+        keep_rx(e, target)
+        amplitude = flipping_output.results.amplitude[target][0]
+        error = flipping_output.results.amplitude[target][1]
+        flipping_round = FlippingRound(
+            nflips_max, amplitude, error, abs(amplitude - current), chi2
+        )
+        print(flipping_round)
+        if after_round is not None:
+            after_round(flipping_round)
+
+        converged = len(rounds) > 0 and flipping_round.correction < rounds[-1].error
+        rounds.append(flipping_round)
+        if converged:
+            break
+        nflips_max *= 2
+        delta_amplitude /= 2
+    return rounds
+
+
+def run_rb(e, target):
+    rb_output = rb_ondevice(
+        e,
+        num_of_sequences=1000,
+        max_circuit_depth=1000,
+        delta_clifford=10,
+        n_avg=1,
+        save_sequences=True,
+        apply_inverse=True,
+    )
+    r_g, r_g_std = rb_infidelity(rb_output, target)
+    print(f"RB gate infidelity {r_g} +- {r_g_std}")
+    return r_g, r_g_std
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Fine tuning calibration iteratively running routines"
     )
@@ -22,8 +103,23 @@ def main():
     parser.add_argument(
         "--platform_update", action="store_true", help="Enable platform update"
     )
+    parser.add_argument(
+        "--max_flips",
+        type=int,
+        default=FLIPPING_MAX,
+        help="Longest flipping sequence of the amplitude refinement",
+    )
+    parser.add_argument(
+        "--rb",
+        type=str,
+        default="end",
+        choices=RB_MODES,
+        help="Run RB after the refinement, after every flipping round or never",
+    )
+
+    args = parser.parse_args(argv)
+    from qibocal.cli.report import report
 
-    args = parser.parse_args()
     platform = args.platform
     target = args.target
     platform_update = args.platform_update
@@ -33,7 +129,7 @@ def main():
 
     path = Path.cwd().parent / "optimization_data" / "sequence" / f"{formatted_time}"
 
-    with Executor.open(
+    with open_executor(
         "myexec",
         path=path,
         platform=platform,
@@ -59,40 +155,12 @@ def main():
                 )
             else:
                 ramsey_output.update_platform(e.platform)
+                keep_rx(e, target)
 
-    # TO MODIFY FROM HERON
-    # up to 50 nflips_max nflips_step can be 1, over 50 maybe muste be iteratively increased
-    # insert iteration (and vary delta_amplitude at each iteration)
-    for i in range(10):
-        flipping_output = e.flipping(
-            nflips_max=20,
-            delta_amplitude=3e-4,  # avarage correction for first flipping tests
-            nflips_step=1,
-        )
-        if flipping_output.results.chi2[target][0] > 2:
-            raise RuntimeError(
-                f"Ramsey fit has chi2 {ramsey_output.results.chi2[target][0]} greater than 2. Stopping."
-            )
-        else:
-            flipping_output.update_platform(e.platform)
-            err = flipping_output.results.amplitude[target][1]
-
-        rb_output = e.rb_ondevice(
-            num_of_sequences=1000,
-            max_circuit_depth=1000,
-            delta_clifford=10,
-            n_avg=1,
-            save_sequences=True,
-            apply_inverse=True,
-        )
-        # do I want to perform an RB after each flipping or not?
-
-        pars = rb_output.results.pars.get(target)
-        one_minus_p = 1 - pars[2]
-        r_c = one_minus_p * (1 - 1 / 2**1)
-        r_g = r_c / AVG_GATE
-
-        # fare flipping iterativi allungando la frequenza (fino a 200-300 flip) <--
+        after_round = (lambda _: run_rb(e, target)) if args.rb == "round" else None
+        refine_amplitude(e, target, max_flips=args.max_flips, after_round=after_round)
+        if args.rb == "end":
+            run_rb(e, target)
 
     report(e.path, e.history)
 
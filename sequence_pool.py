@@ -0,0 +1,203 @@
+import inspect
+import numpy as np
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+POOL_SEQUENCES = 5000  # sequences generated once per run
+POOL_DEPTH = 1000  # longest RB sequence of the backends
+POOL_MODES = ("common", "random")  # same sequences for every candidate, or subsets
+POOL_FILE = "sequence_pool.npz"
+
+
+def _normalized(u):
+    # fix the global phase on the first non-zero entry
+    pivot = u.flat[np.flatnonzero(np.abs(u) > 1e-9)[0]]
+    return u * abs(pivot) / pivot
+
+
+def clifford_group():
+    # the 24 single-qubit Cliffords, up to a global phase, as products of H and S
+    h = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+    s = np.array([[1, 0], [0, 1j]])
+
+    group = [np.eye(2, dtype=complex)]
+    frontier = list(group)
+    while frontier:
+        new = []
+        for u in frontier:
+            for g in (h, s):
+                v = _normalized(g @ u)
+                if not any(np.allclose(v, w) for w in group):
+                    group.append(v)
+                    new.append(v)
+        frontier = new
+    return np.array(group)
+
+
+def multiplication_table(group):
+    # table[i, j] is the index of group[i] @ group[j]
+    flat = group.reshape(len(group), -1)
+    table = np.empty((len(group), len(group)), dtype=np.int8)
+    for i, a in enumerate(group):
+        for j, b in enumerate(group):
+            product = _normalized(a @ b).reshape(-1)
+            table[i, j] = np.flatnonzero(np.isclose(flat, product).all(axis=1))[0]
+    return table
+
+
+CLIFFORDS = clifford_group()
+TABLE = multiplication_table(CLIFFORDS)
+IDENTITY = 0
+INVERSES = np.argmax(TABLE == IDENTITY, axis=1).astype(np.int8)
+
+
+@dataclass(frozen=True)
+class PoolSelection:
+    """Sequences of a pool picked for one RB call, hashable by their indices."""
+
+    pool: "SequencePool"
+    indices: tuple
+
+    @property
+    def sequences(self):
+        return self.pool.sequences[list(self.indices)]
+
+    @property
+    def inverses(self):
+        return self.pool.inverses[list(self.indices)]
+
+    def __hash__(self):
+        return hash((self.pool.seed, self.indices))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, PoolSelection)
+            and self.pool.seed == other.pool.seed
+            and self.indices == other.indices
+        )
+
+
+class SequencePool:
+    """Random Clifford sequences and their recovery gates, generated once.
+
+    ``sequences`` holds Clifford indices (sequences, max_depth) and
+    ``inverses[:, m - 1]`` the Clifford that undoes the first ``m`` gates.
+    With ``common`` every candidate draws the same sequences (common random
+    numbers): the draws of one candidate continue where its previous draw
+    stopped, so the increments and rounds pooled into one estimate stay
+    independent. Otherwise every draw is a random subset of the pool.
+    """
+
+    def __init__(self, sequences, seed, common=True):
+        self.sequences = np.asarray(sequences, dtype=np.int8)
+        self.seed = seed
+        self.common = common
+        self.rng = np.random.default_rng(seed)
+        self.inverses = self._inverses()
+        self.cursors = {}
+
+    @classmethod
+    def generate(
+        cls, max_depth=POOL_DEPTH, num_sequences=POOL_SEQUENCES, seed=None, common=True
+    ):
+        if seed is None:
+            seed = int(np.random.randint(2**31))
+        rng = np.random.default_rng(seed)
+        sequences = rng.integers(len(CLIFFORDS), size=(num_sequences, max_depth))
+        return cls(sequences, seed, common)
+
+    def _inverses(self):
+        # running product of every sequence, gate m is applied after the others
+        product = np.full(len(self.sequences), IDENTITY, dtype=np.int8)
+        inverses = np.empty_like(self.sequences)
+        for m in range(self.sequences.shape[1]):
+            product = TABLE[self.sequences[:, m], product]
+            inverses[:, m] = INVERSES[product]
+        return inverses
+
+    def draw(self, num_sequences, candidate=None):
+        num_sequences = min(num_sequences, len(self.sequences))
+        if self.common:
+            # wraps around once a candidate has used up the pool
+            start = self.cursors.get(candidate, 0)
+            self.cursors[candidate] = start + num_sequences
+            indices = np.arange(start, start + num_sequences) % len(self.sequences)
+        elif num_sequences == len(self.sequences):
+            indices = range(num_sequences)
+        else:
+            indices = np.sort(
+                self.rng.choice(len(self.sequences), num_sequences, replace=False)
+            )
+        return PoolSelection(self, tuple(int(i) for i in indices))
+
+    def save(self, folder):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        # inverses are cheap to recompute, only the sequences are stored
+        np.savez(Path(folder) / POOL_FILE, sequences=self.sequences, seed=self.seed)
+
+
+def load_pool(folder, common=True):
+    data = np.load(Path(folder) / POOL_FILE)
+    return SequencePool(data["sequences"], int(data["seed"]), common)
+
+
+ACTIVE = {"pool": None}
+
+
+def use_pool(pool):
+    # RB calls of every backend draw their sequences from pool, None stops it
+    ACTIVE["pool"] = pool
+
+
+def takes_sequences(e, batch=False):
+    method = e.rb_ondevice_batch if batch else e.rb_ondevice
+    return "sequences" in inspect.signature(method).parameters
+
+
+@contextmanager
+def open_pool(e, mode, folder=None, seed=None):
+    """Pool the RB calls of one run draw from, ``mode`` None runs without one.
+
+    The pool is stored in ``folder`` next to the optimization history and
+    stops being active when the run ends.
+    """
+    if mode is None:
+        yield None
+        return
+    if not takes_sequences(e):
+        raise ValueError("the executor takes no RB sequences to draw from a pool")
+    pool = SequencePool.generate(seed=seed, common=mode == "common")
+    if folder is not None:
+        pool.save(folder)
+    use_pool(pool)
+    try:
+        yield pool
+    finally:
+        use_pool(None)
+
+
+def candidate_key(e):
+    # the RX parameters on the platform identify the candidate being measured
+    key = []
+    for target, qubit in e.platform.qubits.items():
+        rx = qubit.native_gates.RX
+        key.append((target, rx.amplitude, rx.frequency, rx.shape))
+    return tuple(key)
+
+
+def pool_arguments(e, kwargs, batch=False):
+    # executors that take explicit sequences get them from the active pool and
+    # do not need to save them again; a batch measures all its candidates on
+    # one draw, and every batch continues where the previous one stopped
+    pool = ACTIVE["pool"]
+    if pool is None or not takes_sequences(e, batch):
+        return kwargs
+    if kwargs["max_circuit_depth"] > pool.sequences.shape[1]:
+        return kwargs
+    candidate = None if batch else candidate_key(e)
+    return {
+        **kwargs,
+        "sequences": pool.draw(kwargs["num_of_sequences"], candidate),
+        "save_sequences": False,
+    }
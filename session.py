@@ -0,0 +1,68 @@
+import copy
+from contextlib import contextmanager
+
+ACTIVE = {"executor": None, "rx": None}  # rx: values the resident session restores
+RX_FIELDS = ("amplitude", "frequency", "shape")  # written by the drivers
+
+
+def use_executor(e):
+    # drivers run on e instead of opening their own session, None stops it
+    ACTIVE["executor"] = e
+
+
+def open_executor(name, path, platform, targets, update, force=True):
+    """``Executor.open`` unless a resident session is active.
+
+    A resident session (see calibration_daemon) stays connected to the
+    instruments between runs: it is handed back as is, retargeted to the
+    qubits of the run, and it is not closed at the end of the run. Its data
+    goes to the session folder instead of ``path``, and the RX gates and
+    settings the run changed on its platform are restored at the end, but
+    for the RX values the run committed with ``keep_rx``.
+    """
+    from qibocal.auto.execute import Executor
+
+    e = ACTIVE["executor"]
+    if e is None:
+        return Executor.open(
+            name,
+            path=path,
+            platform=platform,
+            targets=targets,
+            update=update,
+            force=force,
+        )
+    if platform != e.platform.name:
+        raise ValueError(
+            f"the resident session runs on {e.platform.name}, not on {platform}"
+        )
+    e.targets = targets
+    e.update = update
+    return restored_platform(e)
+
+
+def rx_values(e, target):
+    rx = e.platform.qubits[target].native_gates.RX
+    return {name: getattr(rx, name) for name in RX_FIELDS}
+
+
+def keep_rx(e, target):
+    # a calibration committed to the platform is what the next run starts from
+    if ACTIVE["rx"] is not None:
+        ACTIVE["rx"][target] = rx_values(e, target)
+
+
+@contextmanager
+def restored_platform(e):
+    # the drivers write every candidate (and nshots) straight onto the
+    # platform, the next run on the session must start from the same values
+    ACTIVE["rx"] = {target: rx_values(e, target) for target in e.platform.qubits}
+    settings = copy.copy(e.platform.settings)
+    try:
+        yield e
+    finally:
+        for target, fields in ACTIVE["rx"].items():
+            for name, value in fields.items():
+                setattr(e.platform.qubits[target].native_gates.RX, name, value)
+        e.platform.settings = settings
+        ACTIVE["rx"] = None
@@ -0,0 +1,453 @@
+import re
+import time
+import numpy as np
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from rb_fit import fit_decay, infidelity
+from tracing import phase, hardware
+from sequence_pool import CLIFFORDS
+
+AVG_GATE = 1.875  # 1.875 is the average number of gates in a Clifford operation
+PULSE_DURATION = 40e-9  # RX duration in seconds, sets the detuning sensitivity
+JOB_OVERHEAD = 2.0  # seconds of upload, compile and readout per hardware job
+COMPILE_TIME = 1.5  # part of JOB_OVERHEAD spent building and compiling the program
+PATCH_TIME = 1e-3  # seconds to write new RX parameters into a compiled program
+SHOT_TIME = 2e-4  # seconds per shot, dominated by the relaxation time
+SPAM_A = 0.45  # amplitude of the RB decay
+SPAM_B = 0.5  # asymptote of the RB decay
+SEQUENCE_SPREAD = 0.1  # sequence-to-sequence spread of the survival, at full decay
+# pi rotations among the Cliffords, the gates most sensitive to coherent errors
+PI_ROTATIONS = np.isclose(np.trace(CLIFFORDS, axis1=1, axis2=2), 0)
+
+
+def parse_drag(shape: str):
+    # shape is stored as repr(pulses.Drag(...)), e.g. "Drag(5, 0.3)"
+    match = re.match(r"\s*Drag\(\s*([^,]+),\s*([^)]+)\)", shape)
+    if match is None:
+        raise ValueError(f"Unsupported pulse shape {shape}")
+    return float(match.group(1)), float(match.group(2))
+
+
+def rb_decay(m, a, b, p):
+    return a * p**m + b
+
+
+def sequence_sensitivity(sequences, depths):
+    # standardized excess of pi rotations in the first m gates of every sequence,
+    # a fixed property of the sequence shared by every candidate measured on it
+    fraction = PI_ROTATIONS.mean()
+    counts = np.cumsum(PI_ROTATIONS[sequences], axis=1)[:, depths - 1]
+    return (counts - depths * fraction) / np.sqrt(depths * fraction * (1 - fraction))
+
+
+@dataclass
+class SimulatedRX:
+    amplitude: float
+    frequency: float
+    shape: str = "Drag(5, 0)"
+
+    def pulse(self, start=0):
+        rel_sigma, beta = parse_drag(self.shape)
+        shape = SimpleNamespace(rel_sigma=rel_sigma, beta=beta)
+        return SimpleNamespace(start=start, shape=shape)
+
+
+@dataclass
+class SimulatedQubit:
+    native_gates: SimpleNamespace
+
+
+@dataclass
+class SimulatedPlatform:
+    qubits: dict
+    settings: SimpleNamespace = field(
+        default_factory=lambda: SimpleNamespace(nshots=1024)
+    )
+
+
+@dataclass
+class SimulatedProgram:
+    """Compiled RB experiment, the RX parameters are patched in when it runs.
+
+    The Clifford sequences are an input of every run, not part of the program,
+    so a reused program never replays the sequences of an earlier run.
+    """
+
+    targets: list
+    num_of_sequences: int
+    max_circuit_depth: int
+    delta_clifford: int
+    n_avg: int
+    executions: int = 0
+
+
+@dataclass
+class QubitModel:
+    """Optimal RX parameters, error budget and drift of one simulated qubit."""
+
+    amplitude: float = 0.0406
+    frequency: float = 4.958e9
+    beta: float = -1.5
+    rel_sigma: float = 5.0
+    floor: float = 1e-3  # incoherent gate error at the optimum
+    beta_curvature: float = 1e-3  # gate error per unit beta squared
+    # random walk of the optimum, per square root of second
+    amplitude_drift: float = 2e-8
+    frequency_drift: float = 100.0
+    beta_drift: float = 1e-4
+
+    def optimum(self):
+        return np.array([self.amplitude, self.frequency, self.beta])
+
+    def drift_rates(self):
+        return np.array([self.amplitude_drift, self.frequency_drift, self.beta_drift])
+
+    def infidelity(self, params, optimum=None):
+        amplitude, frequency, beta = params
+        if optimum is None:
+            optimum = self.optimum()
+        rotation = np.pi * (amplitude - optimum[0]) / optimum[0]
+        phase = 2 * np.pi * (frequency - optimum[1]) * PULSE_DURATION
+        leakage = self.beta_curvature * (beta - optimum[2]) ** 2
+        return self.floor + (rotation**2 + phase**2) / 6 + leakage
+
+
+@dataclass
+class Evaluation:
+    clock: float
+    target: str
+    parameters: np.ndarray
+    true_infidelity: float
+    infidelity: float
+    sequences: int
+
+
+class SimulatedExecutor:
+    """Local stand-in for ``qibocal.auto.execute.Executor``.
+
+    Gate infidelity is a smooth function of the RX amplitude, frequency and DRAG
+    beta, and the optimum drifts as a random walk on a virtual hardware clock.
+    RB results are fitted on binomially sampled survival probabilities, the
+    calibration protocols return noisy estimates of the current optimum.
+    ``realtime`` also sleeps for the simulated hardware time, scaled by
+    ``realtime`` when it is a number (0.01 is a device 100 times faster).
+    """
+
+    def __init__(
+        self,
+        models: dict,
+        seed=None,
+        realtime=False,
+        miscalibration=(0.02, 3e5, 0.5),
+    ):
+        self.models = models
+        self.rng = np.random.default_rng(seed)
+        self.realtime = realtime
+        self.clock = 0.0
+        self.jobs = 0
+        self.compilations = 0
+        self.experiments = 0
+        self.evaluations = []
+        self.path = None
+        self.history = []
+        self.optima = {target: model.optimum() for target, model in models.items()}
+
+        # the platform starts close to, but not at, the optimum
+        amplitude_offset, frequency_offset, beta_offset = miscalibration
+        qubits = {}
+        for target, model in models.items():
+            rx = SimulatedRX(
+                amplitude=model.amplitude * (1 + amplitude_offset),
+                frequency=model.frequency + frequency_offset,
+                shape=f"Drag({model.rel_sigma:g}, {model.beta + beta_offset:g})",
+            )
+            qubits[target] = SimulatedQubit(SimpleNamespace(RX=rx))
+        self.platform = SimulatedPlatform(qubits)
+
+    def _spend(self, seconds, simulated=0.0):
+        # simulated is the wall time already spent computing this hardware time
+        self.clock += seconds
+        for target, model in self.models.items():
+            step = model.drift_rates() * np.sqrt(seconds)
+            self.optima[target] = self.optima[target] + self.rng.normal(0, step)
+        if self.realtime:
+            time.sleep(max(seconds * self.realtime - simulated, 0))
+
+    def _spend_shots(self, shots, simulated=0.0):
+        hardware("execution", shots * SHOT_TIME)
+        self._spend(shots * SHOT_TIME, simulated)
+
+    def _job(self):
+        self.jobs += 1
+        hardware("compile_upload", JOB_OVERHEAD)
+        self._spend(JOB_OVERHEAD)
+
+    def true_infidelity(self, target, params):
+        return self.models[target].infidelity(params, self.optima[target])
+
+    def _rb_sample(
+        self,
+        experiments,
+        sequences,
+        max_depth,
+        delta,
+        n_avg,
+        multiplexed=False,
+        clifford_sequences=None,
+    ):
+        # experiments are (target, amplitude, frequency, shape) tuples, sampled
+        # independently; multiplexed experiments run on different qubits at
+        # the same time. Their evaluations are completed by _rb_fit
+        start = time.perf_counter()
+        depths = np.arange(delta, max_depth + 1, delta)
+        nsamples = sequences * n_avg
+        if clifford_sequences is None:
+            with phase("sequence_generation"):
+                clifford_sequences = self.rng.integers(
+                    len(CLIFFORDS), size=(sequences, max_depth)
+                )
+        sensitivity = sequence_sensitivity(clifford_sequences, depths)
+
+        params, true_infidelities, survival = [], [], []
+        for target, amplitude, frequency, shape in experiments:
+            _, beta = parse_drag(shape)
+            params.append(np.array([amplitude, frequency, beta]))
+            r_g = self.true_infidelity(target, params[-1])
+            p = max(1 - 2 * AVG_GATE * r_g, 0)
+            # every sequence is measured n_avg times at each depth
+            decay = rb_decay(depths, SPAM_A, SPAM_B, p)
+            spread = SEQUENCE_SPREAD * (1 - p**depths) * sensitivity
+            probabilities = np.clip(decay + spread, 0, 1)
+            counts = self.rng.binomial(n_avg, probabilities).sum(axis=0)
+            survival.append(counts / nsamples)
+            true_infidelities.append(r_g)
+
+        survival = np.array(survival)
+        # sampling the shots stands for running them, the fit runs on the host
+        sampling = time.perf_counter() - start
+
+        self.experiments += len(experiments)
+        rounds = 1 if multiplexed else len(experiments)
+        self._spend_shots(nsamples * len(depths) * rounds, sampling)
+        evaluations = []
+        for i, (target, *_) in enumerate(experiments):
+            evaluations.append(
+                Evaluation(
+                    self.clock,
+                    target,
+                    params[i],
+                    true_infidelities[i],
+                    np.nan,
+                    sequences,
+                )
+            )
+        self.evaluations.extend(evaluations)
+        return depths, survival, evaluations
+
+    def _rb_fit(self, depths, survival, evaluations):
+        # fitted together, every experiment on its own decay
+        with phase("fit"):
+            pars, cov = fit_decay(depths, survival)
+        r_g_fit, _ = infidelity(pars, cov)
+        for evaluation, r_g in zip(evaluations, r_g_fit):
+            evaluation.infidelity = r_g
+        return depths, survival, pars, cov.reshape(len(survival), 9)
+
+    def _rb_experiments(self, *args, **kwargs):
+        return self._rb_fit(*self._rb_sample(*args, **kwargs))
+
+    def _rb_output(self, targets, depths, survival, pars, cov):
+        results = SimpleNamespace(
+            pars={target: list(pars[i]) for i, target in enumerate(targets)},
+            cov={target: cov[i] for i, target in enumerate(targets)},
+            depths=depths,
+            survival={target: survival[i] for i, target in enumerate(targets)},
+        )
+        return SimpleNamespace(results=results)
+
+    def rb_ondevice(
+        self,
+        num_of_sequences,
+        max_circuit_depth,
+        delta_clifford,
+        n_avg=1,
+        sequences=None,
+        save_sequences=True,
+        apply_inverse=True,
+    ):
+        # builds and compiles the whole program on every call
+        program = self.compile_rb(
+            num_of_sequences, max_circuit_depth, delta_clifford, n_avg
+        )
+        return self.execute_rb(program, sequences)
+
+    def rb_program_key(self):
+        # what a compiled program depends on, besides the patchable amplitude,
+        # frequency and DRAG beta
+        return tuple(
+            (target, parse_drag(qubit.native_gates.RX.shape)[0])
+            for target, qubit in self.platform.qubits.items()
+        )
+
+    def compile_rb(
+        self,
+        num_of_sequences,
+        max_circuit_depth,
+        delta_clifford,
+        n_avg=1,
+        save_sequences=True,
+        apply_inverse=True,
+    ):
+        self.compilations += 1
+        hardware("compile", COMPILE_TIME)
+        self._spend(COMPILE_TIME)
+        return SimulatedProgram(
+            list(self.platform.qubits),
+            num_of_sequences,
+            max_circuit_depth,
+            delta_clifford,
+            n_avg,
+        )
+
+    def execute_rb(self, program, sequences=None):
+        # sequences is a PoolSelection, None draws new ones for this run
+        return self.fit_rb(self.acquire_rb(program, sequences))
+
+    def acquire_rb(self, program, sequences=None):
+        # execute_rb up to the fit, which fit_rb runs on the host afterwards
+        if program.executions:
+            hardware("patch", PATCH_TIME)
+            self._spend(PATCH_TIME)
+        program.executions += 1
+        self.jobs += 1
+        hardware("upload", JOB_OVERHEAD - COMPILE_TIME)
+        self._spend(JOB_OVERHEAD - COMPILE_TIME)
+
+        experiments = []
+        for target in program.targets:
+            rx = self.platform.qubits[target].native_gates.RX
+            experiments.append((target, rx.amplitude, rx.frequency, rx.shape))
+        sampled = self._rb_sample(
+            experiments,
+            program.num_of_sequences,
+            program.max_circuit_depth,
+            program.delta_clifford,
+            program.n_avg,
+            multiplexed=True,
+            clifford_sequences=None if sequences is None else sequences.sequences,
+        )
+        return SimpleNamespace(targets=program.targets, sampled=sampled)
+
+    def fit_rb(self, data):
+        return self._rb_output(data.targets, *self._rb_fit(*data.sampled))
+
+    def rb_ondevice_batch(
+        self,
+        candidates,
+        target,
+        num_of_sequences,
+        max_circuit_depth,
+        delta_clifford,
+        n_avg=1,
+        sequences=None,
+        save_sequences=True,
+        apply_inverse=True,
+    ):
+        # all candidates share one upload, compile and readout, and the same
+        # sequences (a PoolSelection, None draws new ones)
+        self._job()
+        experiments = [
+            (target, c["amplitude"], c["frequency"], c["shape"]) for c in candidates
+        ]
+        depths, survival, pars, cov = self._rb_experiments(
+            experiments,
+            num_of_sequences,
+            max_circuit_depth,
+            delta_clifford,
+            n_avg,
+            clifford_sequences=None if sequences is None else sequences.sequences,
+        )
+        return [
+            self._rb_output([target], depths, survival[[i]], pars[[i]], cov[[i]])
+            for i in range(len(candidates))
+        ]
+
+    def _protocol_output(self, results, update):
+        output = SimpleNamespace(results=SimpleNamespace(**results))
+        output.update_platform = lambda platform: update(platform)
+        return output
+
+    def drag_tuning(self, beta_start, beta_end, beta_step, **kwargs):
+        self._job()
+        nshots = self.platform.settings.nshots
+        betas = np.arange(beta_start, beta_end, beta_step)
+        self._spend_shots(nshots * len(betas))
+
+        results = {"betas": {}}
+        for target in self.platform.qubits:
+            std = beta_step / np.sqrt(nshots / 100)
+            best = self.optima[target][2] + self.rng.normal(0, std)
+            results["betas"][target] = float(np.clip(best, beta_start, beta_end))
+
+        def update(platform):
+            for target, beta in results["betas"].items():
+                rx = platform.qubits[target].native_gates.RX
+                rel_sigma, _ = parse_drag(rx.shape)
+                rx.shape = f"Drag({rel_sigma:g}, {beta:g})"
+
+        return self._protocol_output(results, update)
+
+    def ramsey(
+        self,
+        delay_between_pulses_start,
+        delay_between_pulses_end,
+        delay_between_pulses_step,
+        detuning=0,
+        relaxation_time=None,
+        **kwargs,
+    ):
+        self._job()
+        nshots = self.platform.settings.nshots
+        delays = np.arange(
+            delay_between_pulses_start,
+            delay_between_pulses_end,
+            delay_between_pulses_step,
+        )
+        self._spend_shots(nshots * len(delays))
+
+        # frequency resolution improves with the longest delay (in ns)
+        std = 1 / (2 * np.pi * delay_between_pulses_end * 1e-9 * np.sqrt(nshots))
+        results = {"frequency": {}, "delta_phys": {}, "chi2": {}}
+        for target, qubit in self.platform.qubits.items():
+            estimate = self.optima[target][1] + self.rng.normal(0, std)
+            current = qubit.native_gates.RX.frequency
+            results["frequency"][target] = (estimate, std)
+            results["delta_phys"][target] = (abs(estimate - current), std)
+            results["chi2"][target] = (self.rng.chisquare(len(delays)) / len(delays), 0)
+
+        def update(platform):
+            for target, (frequency, _) in results["frequency"].items():
+                platform.qubits[target].native_gates.RX.frequency = frequency
+
+        return self._protocol_output(results, update)
+
+    def flipping(self, nflips_max, nflips_step=1, delta_amplitude=0, **kwargs):
+        self._job()
+        nshots = self.platform.settings.nshots
+        nflips = np.arange(0, nflips_max, nflips_step)
+        self._spend_shots(nshots * len(nflips))
+
+        # the rotation error is amplified by the number of flips
+        results = {"amplitude": {}, "chi2": {}}
+        for target in self.platform.qubits:
+            optimum = self.optima[target][0]
+            std = optimum / (np.pi * nflips_max * np.sqrt(nshots))
+            estimate = optimum + self.rng.normal(0, std)
+            results["amplitude"][target] = (estimate, std)
+            results["chi2"][target] = (self.rng.chisquare(len(nflips)) / len(nflips), 0)
+
+        def update(platform):
+            for target, (amplitude, _) in results["amplitude"].items():
+                platform.qubits[target].native_gates.RX.amplitude = amplitude
+
+        return self._protocol_output(results, update)
@@ -0,0 +1,87 @@
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from cli import COMMANDS
+
+STARTUP_BUDGET = 0.5  # seconds from a fresh interpreter to the help of a command
+REPEATS = 5  # fresh interpreters per command, the fastest one counts
+SLOWEST_IMPORTS = 5  # listed for every command over budget
+CLI = str(Path(__file__).with_name("cli.py"))
+
+
+def parse(argv=None) -> Namespace:
+    parser = ArgumentParser(
+        description="Cold startup time of the calibration CLI, fails over budget"
+    )
+    parser.add_argument(
+        "--commands",
+        nargs="+",
+        default=list(COMMANDS),
+        choices=list(COMMANDS),
+        help="Commands to time",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=STARTUP_BUDGET,
+        help="Seconds allowed to start a command and print its help",
+    )
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    return parser.parse_args(argv)
+
+
+def startup_time(command, repeats=REPEATS):
+    # nothing is shared between runs but the OS file cache
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, CLI, command, "--help"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def slowest_imports(command, count=SLOWEST_IMPORTS):
+    # cumulative microseconds of the top-level imports, from -X importtime
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", CLI, command, "--help"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented, the header has no numbers
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(argv=None):
+    args = parse(argv)
+
+    over = []
+    for command in args.commands:
+        seconds = startup_time(command, args.repeats)
+        print(f"{command:<10} {seconds:.3f} s")
+        if seconds > args.budget:
+            over.append(command)
+            for cumulative, name in slowest_imports(command):
+                print(f"    {cumulative:.3f} s  {name}")
+
+    if over:
+        print(f"over the {args.budget} s budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
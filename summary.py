@@ -1,183 +1,338 @@
 import os
-import optuna
+import json
+import sqlite3
 import numpy as np
-import pandas as pd
-
-
-def process_opt(folders):
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from argparse import ArgumentParser
+from pathlib import Path
+from history import load_history, HISTORY_FILE, HISTORY_NPZ
+from parameter_space import PARAMETERS
+
+ANALYSIS_DIR = "opt_analysis"
+SUMMARY_FILE = "summary_with_improvement.csv"
+INDEX_FILE = "summary_index.json"  # history signature of every summarized run
+DB_PATHS = [
+    "../optuna_data/D1_20241110_074214.db",
+    "../optuna_data/D1_20241118_151919.db",
+    "../optuna_data/D1_20241109_114242.db",
+    "../optuna_data/D1_20241121_192626.db",
+]
+
+
+def run_signature(path):
+    # changes whenever a run appends a step or an old run is rewritten
+    path = Path(path)
+    stream = path / HISTORY_FILE
+    stat = (stream if stream.exists() else path / HISTORY_NPZ).stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def discover_runs(root=ANALYSIS_DIR):
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    return sorted(
+        folder.name
+        for folder in root.iterdir()
+        if (folder / HISTORY_FILE).exists() or (folder / HISTORY_NPZ).exists()
+    )
+
+
+def summarize_run(path):
+    # streamed history if present, also readable while the run is going
+    data = load_history(path)
+
+    iterations = data["iterations"]
+    parameters = data["parameters"]
+    objective_values = data["objective_values"]
+
+    if len(objective_values) == 0:
+        # run started, nothing measured yet
+        return None
+
+    best_idx = np.argmin(objective_values)
+
+    # Cost values
+    cost_initial = objective_values[0]
+    cost_best = objective_values[best_idx]
+    cost_final = objective_values[-1]
+
+    # Cost improvements
+    improvement_best = 100 * (cost_initial - cost_best) / cost_initial
+    improvement_final = 100 * (cost_initial - cost_final) / cost_initial
+
+    # Fidelity values
+    fidelity_initial = 1 - cost_initial
+    fidelity_best = 1 - cost_best
+    fidelity_final = 1 - cost_final
+
+    # Fidelity improvements
+    fidelity_improvement_best = (
+        100 * (fidelity_best - fidelity_initial) / fidelity_initial
+    )
+    fidelity_improvement_final = (
+        100 * (fidelity_final - fidelity_initial) / fidelity_initial
+    )
+
+    # Parameters
+    A_best = parameters[best_idx, 0]
+    f_best = parameters[best_idx, 1]
+    A_final = parameters[-1, 0]
+    f_final = parameters[-1, 1]
+
+    B_best = B_final = None
+    if parameters.shape[1] > 2:
+        B_best = parameters[best_idx, 2]
+        B_final = parameters[-1, 2]
+
+    row = {
+        "Analysis Name": Path(path).name,
+        "cost_initial": cost_initial,
+        "cost_best": cost_best,
+        "index_best": best_idx,
+        "A best [a.u.]": A_best,
+        "f best [Hz]": f_best,
+        "B best": B_best,
+        "cost_final": cost_final,
+        "A final [a.u.]": A_final,
+        "f final [Hz]": f_final,
+        "B final": B_final,
+        "improvement_best [%]": improvement_best,
+        "improvement_final [%]": improvement_final,
+        "fidelity_initial": fidelity_initial,
+        "fidelity_best": fidelity_best,
+        "fidelity_final": fidelity_final,
+        "fidelity_improvement_best [%]": fidelity_improvement_best,
+        "fidelity_improvement_final [%]": fidelity_improvement_final,
+    }
+    return row
+
+
+def process_opt(folders=None, root=ANALYSIS_DIR, output=SUMMARY_FILE, workers=None):
+    """Update the summary table with the runs that changed since the last call.
+
+    Runs are discovered in ``root`` unless ``folders`` is given. The history
+    signature of every summarized run is kept in an index next to ``output``,
+    so unchanged runs are skipped and only new or updated ones are loaded, in
+    a process pool.
+    """
+    import pandas as pd
+
+    if folders is None:
+        folders = discover_runs(root)
+    index_path = Path(output).with_name(INDEX_FILE)
+    index, summary = {}, None
+    if index_path.exists() and Path(output).exists():
+        index = json.loads(index_path.read_text())
+        summary = pd.read_csv(output)
+
+    signatures = {folder: run_signature(Path(root) / folder) for folder in folders}
+    changed = [folder for folder in folders if index.get(folder) != signatures[folder]]
+
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(summarize_run, [Path(root) / f for f in changed]))
+    else:
+        rows = []
+    for folder, row in zip(changed, rows):
+        if row is None:
+            # empty history, retried on the next call
+            index.pop(folder, None)
+        else:
+            index[folder] = signatures[folder]
+
+    rows = pd.DataFrame([row for row in rows if row is not None])
+    if summary is not None:
+        # keep rows of unchanged runs, also of runs no longer in folders
+        summary = summary[~summary["Analysis Name"].isin(changed)]
+        rows = pd.concat([summary, rows], ignore_index=True)
+    if not rows.empty:
+        rows = rows.sort_values("Analysis Name", ignore_index=True)
+
+    rows.to_csv(output, index=False)
+    index_path.write_text(json.dumps(index, indent=1))
+    return rows
+
+
+# first, best and final completed trial of a study, as (trial_id, number, value)
+TRIAL_QUERIES = {
+    order: "SELECT t.trial_id, t.number, v.value FROM trials t "
+    "JOIN trial_values v ON v.trial_id = t.trial_id "
+    "WHERE t.study_id = ? AND t.state = 'COMPLETE' AND v.objective = 0 "
+    f"ORDER BY {order} LIMIT 1"
+    for order in ("t.number", "v.value, t.number", "t.number DESC")
+}
+PARAMS_QUERY = "SELECT param_name, param_value FROM trial_params WHERE trial_id = ?"
+
+
+def study_row(study_name, first, best, final):
+    # first, best and final are (number, value, params) of completed trials
+    cost_initial = first[1]
+    cost_best = best[1]
+    cost_final = final[1]
+
+    improvement_best = 100 * (cost_initial - cost_best) / cost_initial
+    improvement_final = 100 * (cost_initial - cost_final) / cost_initial
+
+    # Fidelity calculations
+    fidelity_initial = 1 - cost_initial
+    fidelity_best = 1 - cost_best
+    fidelity_final = 1 - cost_final
+
+    fidelity_improvement_best = (
+        100 * (fidelity_best - fidelity_initial) / fidelity_initial
+    )
+    fidelity_improvement_final = (
+        100 * (fidelity_final - fidelity_initial) / fidelity_initial
+    )
+
+    return {
+        "Analysis Name": study_name,
+        "cost_initial": cost_initial,
+        "cost_best": cost_best,
+        "index_best": best[0],
+        "A best [a.u.]": best[2].get("amplitude"),
+        "f best [Hz]": best[2].get("frequency"),
+        "B best": best[2].get("beta"),
+        "cost_final": cost_final,
+        "A final [a.u.]": final[2].get("amplitude"),
+        "f final [Hz]": final[2].get("frequency"),
+        "B final": final[2].get("beta"),
+        "improvement_best [%]": improvement_best,
+        "improvement_final [%]": improvement_final,
+        "fidelity_initial": fidelity_initial,
+        "fidelity_best": fidelity_best,
+        "fidelity_final": fidelity_final,
+        "fidelity_improvement_best [%]": fidelity_improvement_best,
+        "fidelity_improvement_final [%]": fidelity_improvement_final,
+    }
+
+
+def summarize_sqlite(db_file):
+    # three indexed queries per study, no trial is loaded into optuna objects
     rows = []
-
-    for folder in folders:
-        path = os.path.join("opt_analysis", folder, "optimization_history.npz")
-        data = np.load(path)
-
-        iterations = data["iterations"]
-        parameters = data["parameters"]
-        objective_values = data["objective_values"]
-
-        best_idx = np.argmin(objective_values)
-
-        # Cost values
-        cost_initial = objective_values[0]
-        cost_best = objective_values[best_idx]
-        cost_final = objective_values[-1]
-
-        # Cost improvements
-        improvement_best = 100 * (cost_initial - cost_best) / cost_initial
-        improvement_final = 100 * (cost_initial - cost_final) / cost_initial
-
-        # Fidelity values
-        fidelity_initial = 1 - cost_initial
-        fidelity_best = 1 - cost_best
-        fidelity_final = 1 - cost_final
-
-        # Fidelity improvements
-        fidelity_improvement_best = (
-            100 * (fidelity_best - fidelity_initial) / fidelity_initial
+    uri = f"{Path(db_file).absolute().as_uri()}?mode=ro"
+    with closing(sqlite3.connect(uri, uri=True)) as con:
+        studies = con.execute("SELECT study_id, study_name FROM studies").fetchall()
+        for study_id, study_name in studies:
+            trials = []
+            for query in TRIAL_QUERIES.values():
+                trial = con.execute(query, (study_id,)).fetchone()
+                if trial is None:
+                    break
+                # sqlite stores float params as their internal representation
+                params = dict(con.execute(PARAMS_QUERY, (trial[0],)).fetchall())
+                trials.append((trial[1], trial[2], params))
+            if trials:
+                rows.append(study_row(study_name, *trials))
+    return rows
+
+
+def summarize_journal(log_file):
+    # journal files have no index to query, replay them once with optuna
+    import optuna
+
+    storage = optuna.storages.JournalStorage(
+        optuna.storages.journal.JournalFileBackend(str(log_file))
+    )
+    rows = []
+    for summary in optuna.get_all_study_summaries(storage, include_best_trial=False):
+        study = optuna.load_study(study_name=summary.study_name, storage=storage)
+        trials = study.get_trials(
+            deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)
         )
-        fidelity_improvement_final = (
-            100 * (fidelity_final - fidelity_initial) / fidelity_initial
+        if not trials:
+            continue
+        first, final = trials[0], trials[-1]
+        best = min(trials, key=lambda trial: (trial.value, trial.number))
+        rows.append(
+            study_row(
+                summary.study_name,
+                *((t.number, t.value, t.params) for t in (first, best, final)),
+            )
         )
-
-        # Parameters
-        A_best = parameters[best_idx, 0]
-        f_best = parameters[best_idx, 1]
-        A_final = parameters[-1, 0]
-        f_final = parameters[-1, 1]
-
-        B_best = B_final = None
-        if parameters.shape[1] > 2:
-            B_best = parameters[best_idx, 2]
-            B_final = parameters[-1, 2]
-
-        row = {
-            "Analysis Name": folder,
-            "cost_initial": cost_initial,
-            "cost_best": cost_best,
-            "index_best": best_idx,
-            "A best [a.u.]": A_best,
-            "f best [Hz]": f_best,
-            "B best": B_best,
-            "cost_final": cost_final,
-            "A final [a.u.]": A_final,
-            "f final [Hz]": f_final,
-            "B final": B_final,
-            "improvement_best [%]": improvement_best,
-            "improvement_final [%]": improvement_final,
-            "fidelity_initial": fidelity_initial,
-            "fidelity_best": fidelity_best,
-            "fidelity_final": fidelity_final,
-            "fidelity_improvement_best [%]": fidelity_improvement_best,
-            "fidelity_improvement_final [%]": fidelity_improvement_final,
-        }
-
-        rows.append(row)
-
-    # Build DataFrame
-    df = pd.DataFrame(rows)
-    df.to_csv("summary_with_improvement.csv", index=False)
+    return rows
 
 
-def process_optuna_study(db_paths, db_filename="optuna.sb"):
+def summarize_storage(path):
+    if Path(path).suffix == ".db":
+        return summarize_sqlite(path)
+    return summarize_journal(path)
 
-    rows = []
 
-    for db_file in db_paths:
-        filename = os.path.basename(db_file)
+def process_optuna_study(db_paths, output="optuna_summary.csv", workers=None):
+    """Summarize every study in the given SQLite or journal storages.
 
-        # Extract study name from filename (after the first underscore)
-        study_name = filename.split("_", 1)[1].replace(".db", "")
+    Storages are read in a process pool, one per task, so only the summary
+    rows are held in memory. Studies without completed trials are skipped.
+    """
+    import pandas as pd
 
-        db_path = f"sqlite:///{os.path.abspath(db_file)}"
-
-        study = optuna.load_study(study_name=study_name, storage=db_path)
-
-        trials_df = study.trials_dataframe(attrs=("number", "value", "params", "state"))
-
-        # Filter only completed trials
-        trials_df = trials_df[trials_df["state"] == "COMPLETE"]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for storage_rows in pool.map(summarize_storage, db_paths):
+            rows.extend(storage_rows)
 
-        if trials_df.empty:
-            return None
+    df = pd.DataFrame(rows)
+    df.to_csv(output, index=False)
+    return df
 
-        # Sort by trial number (to get initial and final)
-        trials_df = trials_df.sort_values("number")
 
-        cost_initial = trials_df.iloc[0]["value"]
-        cost_final = trials_df.iloc[-1]["value"]
-        best_trial = study.best_trial
-        cost_best = best_trial.value
+def process_results(root=None, filters=None, output="results_summary.csv"):
+    """Summarize scipy, CMA and Optuna runs alike from the Parquet dataset.
 
-        improvement_best = 100 * (cost_initial - cost_best) / cost_initial
-        improvement_final = 100 * (cost_initial - cost_final) / cost_initial
+    Only the columns needed for the summary are read; ``filters`` selects
+    runs before loading, e.g. ``[("backend", "=", "optuna")]``.
+    """
+    import pandas as pd
+    from results_store import read_results, RESULTS_DIR
 
-        # Fidelity calculations
-        fidelity_initial = 1 - cost_initial
-        fidelity_best = 1 - cost_best
-        fidelity_final = 1 - cost_final
+    columns = ["backend", "run", "iteration", "objective_value", "state", *PARAMETERS]
+    df = read_results(columns=columns, filters=filters, root=root or RESULTS_DIR)
+    df = df[df["state"] == "COMPLETE"].sort_values(["run", "iteration"])
 
-        fidelity_improvement_best = (
-            100 * (fidelity_best - fidelity_initial) / fidelity_initial
-        )
-        fidelity_improvement_final = (
-            100 * (fidelity_final - fidelity_initial) / fidelity_initial
+    rows = []
+    for run, trials in df.groupby("run", observed=True, sort=True):
+        trials = trials.reset_index(drop=True)
+        first, final = trials.iloc[0], trials.iloc[-1]
+        best = trials.iloc[trials["objective_value"].idxmin()]
+        row = study_row(
+            run,
+            *(
+                (t["iteration"], t["objective_value"], t[PARAMETERS].to_dict())
+                for t in (first, best, final)
+            ),
         )
-
-        # Parameters
-        A_best = best_trial.params.get("amplitude")
-        f_best = best_trial.params.get("frequency")
-        B_best = best_trial.params.get("beta", None)
-
-        A_final = trials_df.iloc[-1]["params_amplitude"]
-        f_final = trials_df.iloc[-1]["params_frequency"]
-        B_final = trials_df.iloc[-1].get("params_beta", None)
-
-        row = {
-            "Analysis Name": study,
-            "cost_initial": cost_initial,
-            "cost_best": cost_best,
-            "index_best": best_trial.number,
-            "A best [a.u.]": A_best,
-            "f best [Hz]": f_best,
-            "B best": B_best,
-            "cost_final": cost_final,
-            "A final [a.u.]": A_final,
-            "f final [Hz]": f_final,
-            "B final": B_final,
-            "improvement_best [%]": improvement_best,
-            "improvement_final [%]": improvement_final,
-            "fidelity_initial": fidelity_initial,
-            "fidelity_best": fidelity_best,
-            "fidelity_final": fidelity_final,
-            "fidelity_improvement_best [%]": fidelity_improvement_best,
-            "fidelity_improvement_final [%]": fidelity_improvement_final,
-        }
-
-        rows.append(row)
+        rows.append({"backend": first["backend"], **row})
 
     df = pd.DataFrame(rows)
-    df.to_csv("optuna_summary.csv", index=False)
+    df.to_csv(output, index=False)
+    return df
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Summarize optimization runs and studies")
+    parser.add_argument(
+        "--storages",
+        nargs="*",
+        default=DB_PATHS,
+        help="Optuna SQLite or journal storages to summarize",
+    )
+    parser.add_argument(
+        "--results",
+        action="store_true",
+        help="Also summarize the Parquet dataset of results_store",
+    )
+    args = parser.parse_args(argv)
 
+    print(os.getcwd())
 
-if __name__ == "__main__":
+    process_opt()
+    process_optuna_study(args.storages)
+    if args.results:
+        process_results()
 
-    print(os.getcwd())
 
-    folders = [
-        "D1_cma_post_ft_true",
-        "D1_init_simplex_20241110_211211",
-        "D1_nelder-mead_post_ft_true",
-        "D1_init_simplex_20241113_181711",
-        "D1_init_simplex_20241113_200745",
-        "D1_SLSQP_post_ft_true",
-    ]
-
-    db_paths = [
-        "../optuna_data/D1_20241110_074214.db",
-        "../optuna_data/D1_20241118_151919.db",
-        "../optuna_data/D1_20241109_114242.db",
-        "../optuna_data/D1_20241121_192626.db",
-    ]
-
-    process_opt(folders)
-    process_optuna_study(db_paths)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import threading
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+TRACE_FILE = "trace.jsonl"
+
+
+class Tracer:
+    """Timing of named phases, written as one JSON line per span.
+
+    Spans are numbered by the objective evaluation they belong to and carry
+    their nesting depth, counted per thread (a pipelined run times its
+    hardware jobs on a worker thread). Phases timed on the wall clock are
+    measured here, ``hardware`` phases are reported by executors that know
+    their own cost. Nothing is recorded until ``open`` is called.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.context = {}
+        self.evaluation = None
+        self.count = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+
+    @property
+    def depth(self):
+        return getattr(self.local, "depth", 0)
+
+    @depth.setter
+    def depth(self, value):
+        self.local.depth = value
+
+    def open(self, folder, **context):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        self.file = open(Path(folder) / TRACE_FILE, "a")
+        self.context = context
+        self.t0 = time.perf_counter()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+
+    def record(self, phase, start, duration, clock="wall"):
+        if self.file is None:
+            return
+        span = {
+            **self.context,
+            "evaluation": self.evaluation,
+            "phase": phase,
+            "depth": self.depth,
+            "clock": clock,
+            "start": start - self.t0,
+            "duration": duration,
+        }
+        with self.lock:
+            self.file.write(json.dumps(span) + "\n")
+            self.file.flush()
+
+    @contextmanager
+    def phase(self, name):
+        if self.file is None:
+            yield
+            return
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self.record(name, start, time.perf_counter() - start)
+
+    @contextmanager
+    def evaluation_span(self):
+        # nested evaluations (e.g. a cached lookup) belong to the outer one
+        if self.evaluation is not None:
+            yield
+            return
+        self.evaluation = self.count
+        self.count += 1
+        try:
+            with self.phase("evaluation"):
+                yield
+        finally:
+            self.evaluation = None
+
+
+TRACER = Tracer()
+
+
+def phase(name):
+    return TRACER.phase(name)
+
+
+def evaluation():
+    return TRACER.evaluation_span()
+
+
+class OptimizerClock:
+    """Time an optimizer spends between its calls into the run.
+
+    For optimizers that keep the loop to themselves (scipy ``minimize``,
+    ``study.optimize``): the functions they call back are wrapped with
+    ``wrap`` and every stretch outside them is traced as the ``optimizer``
+    phase, up to ``stop``.
+    """
+
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def wrap(self, function):
+        def wrapped(*args, **kwargs):
+            self.stop()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.last = time.perf_counter()
+
+        return wrapped
+
+    def stop(self):
+        TRACER.record("optimizer", self.last, time.perf_counter() - self.last)
+
+
+def hardware(name, seconds):
+    # cost reported by the executor instead of measured on the wall clock
+    TRACER.record(name, time.perf_counter(), seconds, clock="hardware")
+
+
+def load_trace(folder):
+    import pandas as pd
+
+    path = Path(folder)
+    if path.is_dir():
+        path = path / TRACE_FILE
+    return pd.read_json(path, lines=True)
+
+
+def _covered(starts, ends):
+    # length of the union of the spans, top-level spans of different threads
+    # overlap in a pipelined run
+    covered, reach = 0.0, float("-inf")
+    for start, end in sorted(zip(starts, ends)):
+        covered += max(end - max(start, reach), 0)
+        reach = max(reach, end)
+    return covered
+
+
+def summarize_trace(trace):
+    summary = trace.groupby(["clock", "phase"])["duration"].agg(
+        total="sum", mean="mean", count="count"
+    )
+
+    # wall time outside every top-level span: optimizer bookkeeping, logging,
+    # and whatever is not instrumented
+    wall = trace[trace["clock"] == "wall"]
+    top = wall[wall["depth"] == 0]
+    elapsed = {}
+    if not top.empty:
+        ends = top["start"] + top["duration"]
+        elapsed["wall"] = ends.max() - top["start"].min()
+        untraced = elapsed["wall"] - _covered(top["start"], ends)
+        summary.loc[("wall", "untraced"), :] = [untraced, untraced, 1]
+    hardware = trace[trace["clock"] == "hardware"]
+    if not hardware.empty:
+        elapsed["hardware"] = hardware["duration"].sum()
+
+    # nested phases are shares of the same run time, they do not add up to 1
+    clocks = summary.index.get_level_values("clock")
+    summary["fraction"] = summary["total"] / clocks.map(elapsed).astype(float)
+    return summary
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Summarize the phase trace of a run")
+    parser.add_argument("folders", nargs="+", help="Run folders or trace files")
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    with pd.option_context("display.width", 200):
+        for folder in args.folders:
+            print(folder)
+            print(summarize_trace(load_trace(folder)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import time
+import numpy as np
+from dataclasses import dataclass
+from pathlib import Path
+from history import load_history, HISTORY_FILE, HISTORY_NPZ
+from parameter_space import PARAMETERS
+
+ANALYSIS_DIR = "../opt_analysis"
+OPTUNA_DIR = "../optuna_data"
+WARM_START_POINTS = 10  # best recent evaluations a warm start is built from
+AGE_SCALE = 86400.0  # seconds, weights decay as exp(-age / AGE_SCALE) with drift
+MAX_AGE = 14 * 86400.0  # older evaluations are ignored
+STD_FLOOR = np.array([1e-4, 2e4, 0.05])  # smallest search spread per parameter
+COLUMNS = ["run", "time", *PARAMETERS, "objective_value", "error"]
+
+
+def history_evaluations(target, root=ANALYSIS_DIR):
+    # runs are named {target}_{backend}..., histories do not store when every
+    # step was taken, all of them get the time the file was last written
+    import pandas as pd
+
+    frames = []
+    for folder in sorted(Path(root).glob(f"{target}_*")):
+        files = [folder / name for name in (HISTORY_FILE, HISTORY_NPZ)]
+        files = [path for path in files if path.exists()]
+        if not files:
+            continue
+        data = load_history(folder)
+        parameters = np.full((len(data["parameters"]), len(PARAMETERS)), np.nan)
+        parameters[:, : data["parameters"].shape[1]] = data["parameters"]
+        frame = pd.DataFrame(parameters, columns=PARAMETERS)
+        frame.insert(0, "run", folder.name)
+        frame.insert(1, "time", files[0].stat().st_mtime)
+        frame["objective_value"] = data["objective_values"]
+        frame["error"] = data["objective_value_errors"]
+        frames.append(frame)
+    return frames
+
+
+def study_evaluations(target, root=OPTUNA_DIR):
+    import optuna
+    import pandas as pd
+    from results_store import study_storage
+
+    rows = []
+    paths = [*Path(root).glob(f"{target}_*.db"), *Path(root).glob(f"{target}_*.log")]
+    for path in sorted(paths):
+        storage = study_storage(path)
+        for summary in optuna.get_all_study_summaries(storage, False):
+            study = optuna.load_study(study_name=summary.study_name, storage=storage)
+            states = (optuna.trial.TrialState.COMPLETE,)
+            for trial in study.get_trials(deepcopy=False, states=states):
+                rows.append(
+                    {
+                        "run": summary.study_name,
+                        "time": trial.datetime_complete.timestamp(),
+                        **{name: trial.params.get(name, np.nan) for name in PARAMETERS},
+                        "objective_value": trial.value,
+                        "error": trial.user_attrs.get("error", np.nan),
+                    }
+                )
+    return [pd.DataFrame(rows, columns=COLUMNS)] if rows else []
+
+
+def index_runs(target, analysis_dir=ANALYSIS_DIR, optuna_dir=OPTUNA_DIR):
+    """Every past evaluation of ``target`` in the run histories and Optuna
+    studies, with the time it was taken."""
+    import pandas as pd
+
+    frames = [
+        *history_evaluations(target, analysis_dir),
+        *study_evaluations(target, optuna_dir),
+    ]
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+# where the evaluations of an initial state come from, None starts cold
+INITIALIZERS = {
+    "platform": lambda target: None,
+    "history": index_runs,
+}
+
+
+@dataclass
+class InitialState:
+    """Starting point (amplitude, frequency, beta) of an optimization.
+
+    A warm start also carries the spread of the good past evaluations around
+    it and the evaluations themselves, best first. A cold start from the
+    platform has neither.
+    """
+
+    x0: np.ndarray
+    stds: np.ndarray = None
+    points: np.ndarray = None
+
+    def simplex(self):
+        # x0 and one step of the spread along every parameter
+        if self.stds is None:
+            return None
+        return np.vstack([self.x0, self.x0 + np.diag(self.stds)])
+
+
+def warm_start(evaluations, now=None):
+    """InitialState from the best recent ``evaluations``, None without any.
+
+    The start is their weighted mean, the weights decay with age because the
+    optimum drifts; parameters no run optimized are left as nan.
+    """
+    if evaluations.empty:
+        return None
+    now = time.time() if now is None else now
+    # ranked on the upper end of the error bar, failed fits report ~0 with a
+    # huge error
+    score = evaluations["objective_value"] + evaluations["error"].fillna(0)
+    recent = evaluations.assign(score=score)[
+        (now - evaluations["time"] < MAX_AGE) & np.isfinite(score)
+    ]
+    if recent.empty:
+        return None
+
+    best = recent.nsmallest(WARM_START_POINTS, "score")
+    points = best[PARAMETERS].to_numpy(dtype=float)
+    weights = np.exp(-(now - best["time"].to_numpy(dtype=float)) / AGE_SCALE)
+    weights = weights[:, None] * np.isfinite(points)
+    total = weights.sum(axis=0)
+    with np.errstate(invalid="ignore"):
+        x0 = (np.nan_to_num(points) * weights).sum(axis=0) / total
+        variance = (np.nan_to_num(points - x0) ** 2 * weights).sum(axis=0) / total
+    return InitialState(x0, np.fmax(np.sqrt(variance), STD_FLOOR), points)
+
+
+def initial_state(e, target, evaluations=None, drag=True):
+    """Warm start from ``evaluations`` if there are recent ones, otherwise the
+    platform values. With ``drag``, a fresh drag_tuning provides beta when no
+    run did."""
+    state = None if evaluations is None else warm_start(evaluations)
+    if state is None:
+        rx = e.platform.qubits[target].native_gates.RX
+        state = InitialState(np.array([rx.amplitude, rx.frequency, np.nan]))
+    else:
+        print(f"warm start of {target} from {len(state.points)} evaluations")
+    if drag and np.isnan(state.x0[2]):
+        drag_output = e.drag_tuning(beta_start=-4, beta_end=4, beta_step=0.5)
+        state.x0[2] = drag_output.results.betas[target]
+    return state